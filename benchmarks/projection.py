@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+"""projection.py Compares the batched projection fit of modelfactors.py with
+scipy.optimize.curve_fit.
+
+Generates random efficiency series, fits them once with fit_projection and once
+per series with curve_fit, and prints the time of both and the largest
+difference of the fitted curves at the given numbers of processes. Fails if the
+batched fit is worse than curve_fit, i.e. has a larger cost, for any series.
+"""
+
+from __future__ import print_function, division
+import os
+import sys
+import time
+import argparse
+import warnings
+
+import numpy
+import scipy.optimize
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import modelfactors
+
+
+models = {'amdahl': lambda x, x0, f: x0 / (f + (1 - f) * x),
+          'pipe': lambda x, x0, f: x0 * x / ((1 - f) + f * (2 * x - 1)),
+          'linear': lambda x, x0, f: x0 + f * x}
+
+
+def parse_arguments():
+    """Parses the command line arguments."""
+    parser = argparse.ArgumentParser(description='Compares the batched projection fit with scipy.optimize.curve_fit.')
+    parser.add_argument('--series', type=int, default=1000, metavar='N',
+                        help='number of random series (default: 1000)')
+    parser.add_argument('--model', choices=sorted(models), default='amdahl',
+                        help='projection model (default: amdahl)')
+    parser.add_argument('--bounds', choices=['yes', 'no'], default='yes',
+                        help='bound f to [0, 1] (default: yes)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the random series (default: 0)')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    cmdl_args = parse_arguments()
+    modelfactors.import_numpy()
+    warnings.simplefilter('ignore')
+
+    random = numpy.random.default_rng(cmdl_args.seed)
+    x_proc = numpy.array([2, 4, 8, 16, 32, 64], dtype=float)
+    decay = random.uniform(0, 0.2, (cmdl_args.series, 1))
+    y = 95 * (x_proc / x_proc[0]) ** -decay + random.normal(0, 1, (cmdl_args.series, len(x_proc)))
+    sigma = numpy.ones(len(x_proc))
+    sigma[0] = 0.1
+    if cmdl_args.bounds == 'yes':
+        bounds = (0, 1)
+    else:
+        bounds = (-numpy.inf, numpy.inf)
+    model = models[cmdl_args.model]
+
+    time_start = time.time()
+    opt, cov = modelfactors.fit_projection(cmdl_args.model, x_proc, y, sigma, bounds)
+    time_batched = time.time() - time_start
+
+    time_start = time.time()
+    reference = []
+    for series in y:
+        try:
+            reference.append(scipy.optimize.curve_fit(model, x_proc, series, sigma=sigma,
+                                                      bounds=([-numpy.inf, bounds[0]], [numpy.inf, bounds[1]]))[0])
+        except RuntimeError:
+            reference.append(numpy.full(2, numpy.nan))
+    time_reference = time.time() - time_start
+    reference = numpy.array(reference)
+
+    def cost(parameters):
+        with numpy.errstate(all='ignore'):
+            return (((y - model(x_proc, parameters[:, :1], parameters[:, 1:])) / sigma) ** 2).sum(axis=1)
+
+    with numpy.errstate(all='ignore'):
+        difference = numpy.abs(model(x_proc, opt[:, :1], opt[:, 1:]) - model(x_proc, reference[:, :1], reference[:, 1:]))
+    worse = numpy.sum(cost(opt) > cost(reference) * (1 + 1e-7) + 1e-9)
+
+    print('fit_projection:   {0:.3f} seconds'.format(time_batched))
+    print('curve_fit:        {0:.3f} seconds'.format(time_reference))
+    print('Speedup:          {0:.1f}'.format(time_reference / time_batched))
+    print('Median deviation: {0:.2e}'.format(numpy.nanmedian(numpy.nanmax(difference, axis=1))))
+    print('Worse fits:       {0} of {1}'.format(worse, cmdl_args.series))
+
+    sys.exit(1 if worse else 0)
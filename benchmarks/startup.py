@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+"""startup.py Checks the startup time of modelfactors.py against a budget.
+
+Runs modelfactors.py with --version and --help several times and measures the
+time from starting the interpreter to the first output of the script. Fails if
+the median time exceeds the budget, or if loading the script imports NumPy,
+which is only needed for the native reader and the projection, or SciPy.
+"""
+
+from __future__ import print_function, division
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+
+script = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'modelfactors.py')
+
+
+def parse_arguments():
+    """Parses the command line arguments."""
+    parser = argparse.ArgumentParser(description='Checks the startup time of modelfactors.py against a budget.')
+    parser.add_argument('--budget', type=float, default=0.3, metavar='SECONDS',
+                        help='maximum median time from start to first output (default: 0.3)')
+    parser.add_argument('--repeat', type=int, default=9, metavar='N',
+                        help='number of runs per command (default: 9)')
+    return parser.parse_args()
+
+
+def time_to_first_output(args):
+    """Starts the python interpreter with args and returns the time in seconds
+    until the first byte arrives on stdout."""
+    time_start = time.time()
+    process = subprocess.Popen([sys.executable] + args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    process.stdout.read(1)
+    time_first = time.time() - time_start
+    process.stdout.read()
+    process.wait()
+    return time_first
+
+
+def median(values):
+    """Returns the median of a list of values."""
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+
+def get_eager_imports():
+    """Returns the heavy modules that are imported by loading the script."""
+    code = 'import runpy, sys; runpy.run_path(sys.argv[1]); print(" ".join(m for m in ("numpy", "scipy") if m in sys.modules))'
+    output = subprocess.check_output([sys.executable, '-c', code, script])
+    return output.decode().split()
+
+
+if __name__ == "__main__":
+    cmdl_args = parse_arguments()
+
+    failed = False
+
+    baseline = median([time_to_first_output(['-c', 'print()']) for _ in range(cmdl_args.repeat)])
+    print('Interpreter startup:        {0:.3f} seconds'.format(baseline))
+
+    for option in ['--version', '--help']:
+        startup = median([time_to_first_output([script, option]) for _ in range(cmdl_args.repeat)])
+        line = ('modelfactors.py ' + option + ':').ljust(28)
+        line += '{0:.3f} seconds (budget {1:.3f})'.format(startup, cmdl_args.budget)
+        if startup > cmdl_args.budget:
+            line += ' EXCEEDED'
+            failed = True
+        print(line)
+
+    eager = get_eager_imports()
+    if eager:
+        print('Loading modelfactors.py imports ' + ', '.join(eager) + '.')
+        failed = True
+
+    sys.exit(1 if failed else 0)
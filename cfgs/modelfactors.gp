@@ -22,6 +22,7 @@ set key left bottom Left reverse
 #REPLACE_BY_COMM_FUNCTION
 #REPLACE_BY_COMP_FUNCTION
 #REPLACE_BY_GLOB_FUNCTION
+#REPLACE_BY_CONFIDENCE_BANDS
 
 plot para(x) title "Parallel Efficiency" ls 1,\
      load(x) title "Load Balance" ls 2,\
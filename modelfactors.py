@@ -11,18 +11,31 @@ import argparse
 import fnmatch
 import re
 import time
-import resource
-from collections import OrderedDict
+import multiprocessing
+import multiprocessing.pool
+import threading
+import heapq
+import signal
+import asyncio
+import warnings
+import shutil
+import zlib
+import gzip
+import bz2
+import lzma
+import hashlib
+import struct
+import json
+import glob
+from collections import OrderedDict, deque
 
 try:
-    import scipy.optimize
+    from StringIO import StringIO
 except ImportError:
-    print('==ERROR== Could not import SciPy. Please make sure to install a current version.')
+    from io import StringIO
 
-try:
-    import numpy
-except ImportError:
-    print('==ERROR== Could not import NumPy. Please make sure to install a current version.')
+#NumPy is imported on first use, see import_numpy, as importing it takes most
+#of the startup time of the script.
 
 
 __author__ = "Michael Wagner"
@@ -64,6 +77,25 @@ mod_factors_doc = OrderedDict([('parallel_eff', 'Parallel efficiency'),
                                ('freq',         'Average frequency (GHz)')])
 
 
+#Memory budget that is shared by all external tools; set with --memory-budget.
+memory_budget = None
+
+
+def import_numpy():
+    """Imports numpy into the module namespace on first use.
+    Returns False if NumPy is not installed."""
+    global numpy
+    try:
+        numpy.__version__
+    except NameError:
+        try:
+            import numpy
+        except ImportError:
+            print('==ERROR== Could not import NumPy. Please make sure to install a current version.')
+            return False
+    return True
+
+
 def parse_arguments():
     """Parses the command line arguments.
     Currently the script only accepts one parameter list, which is the list of
@@ -76,14 +108,49 @@ def parse_arguments():
     parser.add_argument("-d", "--debug", help="increase output verbosity to debug level", action="store_true")
     parser.add_argument("-s", "--scaling", help="define whether the measurements are weak or strong scaling (default: auto)",
                         choices=['weak','strong','auto'], default='auto')
-    parser.add_argument("-p", "--project", metavar='<path-to-modelfactors.csv>', help="run only the projection for the given modelfactors.csv (default: false)")
+    parser.add_argument("-p", "--project", nargs='+', metavar='<path-to-modelfactors.csv>', help="run only the projection for the given modelfactors.csv. Several files, directories with modelfactors.csv files below them, and wild cards are projected together into modelfactors.projections.csv (default: false)")
+    parser.add_argument("-a", "--append", metavar='<path-to-modelfactors.csv>', help="add the given traces to the series stored in the given modelfactors.csv and analyze only the new traces (default: false)")
     parser.add_argument('--limit', help='limit number of cores for the projection (default: 10000)')
-    parser.add_argument('--model', choices=['amdahl','pipe','linear'], default='amdahl',
-                        help='select model for prediction (default: amdahl)')
+    parser.add_argument('--model', choices=['amdahl','pipe','linear','auto'], default='amdahl',
+                        help='select model for prediction (default: amdahl). auto: select the model per metric that predicts left-out runs best')
     parser.add_argument('--bounds', choices=['yes','no'], default='yes',
                         help='set bounds for the prediction (default: yes)')
     parser.add_argument('--sigma', choices=['first','equal','decrease'], default='first',
                         help='set error restrains for prediction (default: first). first: prioritize smallest run; equal: no priority; decrease: decreasing priority for larger runs')
+    parser.add_argument('--confidence', type=float, nargs='?', const=0.95, metavar='LEVEL',
+                        help='add confidence bands of the given level to the projection, computed by bootstrapping the measured series (default level if given: 0.95)')
+    parser.add_argument('--resamples', type=int, default=2000, metavar='N',
+                        help='number of bootstrap resamples for --confidence (default: 2000)')
+    parser.add_argument('--efficiency-floor', type=float, metavar='PERCENT',
+                        help='recommend the number of processes up to --limit whose projected global efficiency stays at or above PERCENT (default: no floor)')
+    parser.add_argument('--budget', type=float, metavar='CORE_HOURS',
+                        help='recommend the number of processes up to --limit whose projected run costs at most CORE_HOURS; requires the runtime in the raw data (default: no budget)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+                        help='number of traces that are analyzed in parallel, and of processes that compute the bootstrap resamples for --confidence (default: 1)')
+    parser.add_argument('--dim-transfer', choices=['file','scratch','fifo'], default='file',
+                        help='how prv2dim passes the translation to Dimemas (default: file). file: .dim file next to the trace; scratch: .dim file in the scratch directory; fifo: named pipe without a file, falls back to file if the tools need to seek')
+    parser.add_argument('--scratch', metavar='DIR', default=None,
+                        help='node-local directory for the scratch and fifo transfers and the named pipes of compressed traces (default: $TMPDIR or /tmp)')
+    parser.add_argument('--reader', choices=['paramedir','native','check'], default='paramedir',
+                        help='select how the useful durations, runtimes, and counters are computed (default: paramedir). native: read the traces directly without paramedir; check: use paramedir and compare the native results against it')
+    parser.add_argument('--reader-jobs', type=int, default=1, metavar='N',
+                        help='number of processes that read a single trace with the native reader; only used without -j/--jobs (default: 1)')
+    parser.add_argument('--no-index', action='store_true',
+                        help='do not load or write the .prv.idx.npz index of the native reader next to each trace')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue an interrupted run: skip the traces finished in modelfactors.checkpoint.json in the working directory and remove incomplete outputs of the others')
+    parser.add_argument('--cache-dir', metavar='DIR', default=None,
+                        help='directory of the raw data cache (default: $XDG_CACHE_HOME/modelfactors or ~/.cache/modelfactors)')
+    parser.add_argument('--cache-size', type=parse_size, default=parse_size('16M'), metavar='SIZE',
+                        help='maximum size of the raw data cache; the least recently used entries are removed (default: 16M)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='neither use nor update the raw data cache')
+    parser.add_argument('--refresh', action='store_true',
+                        help='analyze all traces again and update the raw data cache')
+    parser.add_argument('--timeout', type=float, metavar='SECONDS',
+                        help='kill Dimemas, prv2dim, and paramedir runs that take longer than SECONDS (default: no timeout)')
+    parser.add_argument('--memory-budget', type=parse_size, metavar='SIZE',
+                        help='maximum memory for concurrently running Dimemas, prv2dim, and paramedir processes, e.g. 64G (default: unlimited)')
 
     if len(sys.argv) == 1:
         parser.print_help()
@@ -91,32 +158,61 @@ def parse_arguments():
 
     cmdl_args = parser.parse_args()
 
+    if cmdl_args.jobs < 1:
+        parser.error('argument -j/--jobs: must be at least 1')
+    if cmdl_args.append and cmdl_args.project:
+        parser.error('argument -a/--append: not allowed with argument -p/--project')
+    if cmdl_args.reader_jobs < 1:
+        parser.error('argument --reader-jobs: must be at least 1')
+    if cmdl_args.confidence is not None and not 0 < cmdl_args.confidence < 1:
+        parser.error('argument --confidence: must be between 0 and 1, e.g. 0.95')
+    if cmdl_args.resamples < 1:
+        parser.error('argument --resamples: must be at least 1')
+    if cmdl_args.efficiency_floor is not None and not 0 < cmdl_args.efficiency_floor <= 100:
+        parser.error('argument --efficiency-floor: must be a percentage between 0 and 100, e.g. 60')
+    if cmdl_args.budget is not None and not cmdl_args.budget > 0:
+        parser.error('argument --budget: must be positive')
+
     if cmdl_args.debug:
         print('==DEBUG== Running in debug mode.')
 
     return cmdl_args
 
 
+def parse_size(text):
+    """Converts a size with an optional suffix K, M, G, or T (powers of 1024)
+    to the number of bytes. Used as argparse type.
+    """
+    suffixes = {'': 0, 'B': 0, 'K': 1, 'M': 2, 'G': 3, 'T': 4}
+    match = re.match(r'^\s*([0-9]*\.?[0-9]+)\s*([KMGT]?)B?\s*$', text.upper())
+    if not match:
+        raise argparse.ArgumentTypeError('invalid size "' + text + '", expected e.g. 512M or 64G')
+    return int(float(match.group(1)) * 1024 ** suffixes[match.group(2)])
+
+
 def get_traces_from_args(cmdl_args):
-    """Filters the given list to extract traces, i.e. matching *.prv and sorts
-    the traces in ascending order based on the number of processes in the trace.
-    Excludes all files other than *.prv and ignores also simulated traces from
-    this script, i.e. *.sim.prv
+    """Filters the given list to extract traces, i.e. matching *.prv or a
+    compressed *.prv.gz, *.prv.bz2, or *.prv.xz, and sorts the traces in
+    ascending order based on the number of processes in the trace.
+    Excludes all other files and ignores also simulated traces from this
+    script, i.e. *.sim.prv
     Returns list of trace paths and dictionary with the number of processes.
     """
-    trace_list = [x for x in cmdl_args.trace_list if fnmatch.fnmatch(x, '*.prv') if not fnmatch.fnmatch(x, '*.sim.prv')]
-    trace_list = sorted(trace_list, key=get_num_processes)
+    trace_list = [x for x in cmdl_args.trace_list if get_trace_base(x) if not fnmatch.fnmatch(x, '*.sim.prv*')]
 
     if not trace_list:
         print('==Error== could not find any traces matching "', ' '.join(cmdl_args.trace_list))
         sys.exit(1)
 
+    trace_metadata = get_trace_metadata(trace_list, cmdl_args)
+    trace_list = sorted(trace_list, key=lambda trace: trace_metadata[trace]['processes'])
+
     trace_processes = dict()
 
     for trace in trace_list:
-        trace_processes[trace] = get_num_processes(trace)
+        trace_processes[trace] = trace_metadata[trace]['processes']
 
-    print_overview(trace_list, trace_processes)
+    print_overview(trace_list, trace_processes, trace_metadata)
     return trace_list, trace_processes
 
 
@@ -127,10 +223,181 @@ def get_num_processes(prv_file):
     Please note: return value needs to be integer because this function is also
     used as sorting key.
     """
-    cpus = open( prv_file[:-4] + '.row' ).readline().rstrip().split(' ')[3]
+    with open(get_trace_base(prv_file) + '.row') as f:
+        cpus = f.readline().rstrip().split(' ')[3]
     return int(cpus)
 
 
+#Version of the records in the metadata cache, increase when they change
+metadata_version = 1
+
+#Number of threads that look up the metadata of the traces concurrently
+metadata_threads = 16
+
+
+def get_trace_metadata(trace_list, cmdl_args):
+    """Discovers the metadata of all traces, see read_trace_metadata. The
+    lookups run concurrently, as they are dominated by the latency of the file
+    system, and the records are kept in the file metadata/traces.json in the
+    cache directory, so an unchanged trace is only stat'ed in later runs. The
+    subdirectory keeps the records out of the eviction of evict_cache.
+    Returns a dictionary <trace><metadata record>.
+    Exits with an error if the number of processes of a trace is unknown.
+    """
+    cache = dict()
+    cache_path = os.path.join(get_cache_dir(cmdl_args), 'metadata', 'traces.json')
+    if not cmdl_args.no_cache and not cmdl_args.refresh:
+        try:
+            with open(cache_path) as f:
+                cache = json.load(f)
+            if not cache.get('version') == metadata_version:
+                cache = dict()
+        except (IOError, OSError, ValueError):
+            cache = dict()
+    records = cache.get('traces', dict())
+
+    def lookup(trace):
+        try:
+            return read_trace_metadata(trace, records.get(os.path.abspath(trace)))
+        except (IOError, OSError, ValueError, IndexError) as error:
+            return str(error)
+
+    threads = min(metadata_threads, len(trace_list))
+    if threads > 1:
+        pool = multiprocessing.pool.ThreadPool(threads)
+        results = pool.map(lookup, trace_list)
+        pool.close()
+        pool.join()
+    else:
+        results = [lookup(trace) for trace in trace_list]
+
+    trace_metadata = dict()
+    for trace, result in zip(trace_list, results):
+        if not isinstance(result, dict):
+            print('==Error== could not determine the number of processes of ' + trace + ' (' + result + ').')
+            sys.exit(1)
+        trace_metadata[trace] = result
+
+    changed = [trace for trace in trace_list if not records.get(os.path.abspath(trace)) == trace_metadata[trace]]
+    if not cmdl_args.no_cache and changed:
+        for trace in changed:
+            records[os.path.abspath(trace)] = trace_metadata[trace]
+        temporary = cache_path + '.' + str(os.getpid()) + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with open(temporary, 'w') as f:
+                json.dump({'version': metadata_version, 'traces': records}, f)
+            os.replace(temporary, cache_path)
+        except (IOError, OSError) as error:
+            print('==Warning== Could not write metadata cache ' + cache_path + ' (' + str(error) + ').')
+            save_remove(temporary)
+
+    return trace_metadata
+
+
+def read_trace_metadata(trace, record=None):
+    """Reads the metadata of a trace: the number of processes from the .row
+    file as get_num_processes, and the number of ranks, threads, and nodes and
+    the duration in microseconds from the header line of the trace. Without
+    .row file, the number of processes is the number of ranks in the header.
+    The size and modification times identify the version of the trace, so a
+    record of a previous lookup is returned if it is still up to date.
+    Returns the metadata record as dictionary.
+    """
+    stat = os.stat(trace)
+    row = get_trace_base(trace) + '.row'
+    try:
+        row_mtime = os.stat(row).st_mtime_ns
+    except OSError:
+        row_mtime = None
+
+    if record and record.get('size') == stat.st_size and record.get('mtime') == stat.st_mtime_ns and \
+       record.get('row_mtime') == row_mtime:
+        return record
+
+    try:
+        with open_trace(trace) as f:
+            header = parse_prv_header(f.readline().decode(errors='replace'))
+    except (IOError, OSError, EOFError, ValueError):
+        if row_mtime is None:
+            raise
+        header = None
+
+    record = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'row_mtime': row_mtime}
+    record['ranks'] = header['tasks'] if header else None
+    record['threads'] = len(header['threads']) if header else None
+    record['nodes'] = header['nodes'] if header else None
+    record['duration'] = header['duration'] / header['to_us'] if header else None
+    record['processes'] = get_num_processes(trace) if row_mtime is not None else header['tasks']
+    return record
+
+
+#Modules to decompress the supported compressed traces by file extension
+trace_compressions = OrderedDict([('.gz', gzip), ('.bz2', bz2), ('.xz', lzma)])
+
+
+def get_trace_base(trace):
+    """Returns the path of the trace without the .prv extension and without the
+    extension of the compression, if any, or '' if the path is not a trace.
+    The output files of the analysis are named after this base path."""
+    for extension in [''] + list(trace_compressions):
+        if trace.endswith('.prv' + extension):
+            return trace[:-len('.prv' + extension)]
+    return ''
+
+
+def get_compression(trace):
+    """Returns the module to decompress the trace, or None for plain traces."""
+    for extension, module in trace_compressions.items():
+        if trace.endswith('.prv' + extension):
+            return module
+    return None
+
+
+def open_trace(trace, mode='rb'):
+    """Opens the trace for reading and decompresses it on the fly."""
+    compression = get_compression(trace)
+    if compression:
+        return compression.open(trace, mode)
+    return open(trace, mode)
+
+
+#Typical compression factor of Paraver traces, assumed for the uncompressed
+#size if the compressed file does not store it
+trace_compression_factor = 10
+
+
+def get_trace_size(trace):
+    """Returns the uncompressed size of the trace in bytes, which the tools
+    read and on which their memory depends. For gzip with a single member, the
+    size is taken from the ISIZE trailer, which stores it modulo 2**32; the
+    multiple of 2**32 that comes closest to the typical compression factor is
+    added. The trailer of a trace with several members, e.g. written by bgzip,
+    only holds the size of the last member, so like for other compressions the
+    typical compression factor is assumed."""
+    size = os.path.getsize(trace)
+    compression = get_compression(trace)
+    if compression is None:
+        return size
+
+    estimate = size * trace_compression_factor
+    if compression is gzip:
+        try:
+            with open(trace, 'rb') as f:
+                f.seek(-4, os.SEEK_END)
+                isize = struct.unpack('<I', f.read(4))[0]
+            #A member in the middle of the trace means several members
+            if len(find_gzip_members(trace, 2)) > 1:
+                return estimate
+        except (IOError, OSError, struct.error):
+            return estimate
+        wraps = max(0, int(round(float(estimate - isize) / 2 ** 32)))
+        if isize + wraps * 2 ** 32 < size:
+            return estimate
+        return isize + wraps * 2 ** 32
+    return estimate
+
+
 def human_readable(size, precision=1):
     """Converts a given size in bytes to the value in human readable form."""
     suffixes=['B','KB','MB','GB','TB']
@@ -141,14 +408,14 @@ def human_readable(size, precision=1):
     return "%.*f%s"%(precision,size,suffixes[suffixIndex])
 
 
-def print_overview(trace_list, trace_processes):
+def print_overview(trace_list, trace_processes, trace_metadata):
     """Prints an overview of the traces that will be processed."""
     print('Running', os.path.basename(__file__), 'for the following traces:')
 
     for trace in trace_list:
         line = trace
         line += ', ' + str(trace_processes[trace]) + ' processes'
-        line += ', ' + human_readable(os.path.getsize(trace))
+        line += ', ' + human_readable(trace_metadata[trace]['size'])
         print(line)
     print('')
 
@@ -178,14 +445,9 @@ def check_installation(cmdl_args):
         print('==DEBUG== Using', __file__, __version__)
         print('==DEBUG== Using', sys.executable, ".".join(map(str, sys.version_info[:3])))
 
-        try:
-            print('==DEBUG== Using', 'SciPy', scipy.__version__)
-        except NameError:
-            print('==DEBUG== SciPy not installed.')
-
-        try:
+        if import_numpy():
             print('==DEBUG== Using', 'NumPy', numpy.__version__)
-        except NameError:
+        else:
             print('==DEBUG== NumPy not installed.')
 
         print('==DEBUG== Using', which('Dimemas'))
@@ -195,31 +457,282 @@ def check_installation(cmdl_args):
     return
 
 
-def run_command(cmd):
-    """Runs a command and forwards the return value."""
-    if cmdl_args.debug:
-        print('==DEBUG== Executing:', ' '.join(cmd))
+class MemoryBudget(object):
+    """Admission control for the external tools based on their peak memory.
+    Before a tool is started, its peak RSS is estimated as the base footprint
+    of the tool plus the largest memory per input byte beyond that footprint
+    that was measured for this tool so far. Runs on inputs below size_floor
+    only update the base footprint, since their peak hardly depends on the
+    input. The tool is delayed until the estimate fits into the budget next to
+    the already running tools. Estimates are capped at the budget; a tool that
+    reaches the cap is started as soon as no other tool is running.
+    The state is shared between the worker processes of the trace pool.
+    """
+    tools = ['prv2dim', 'Dimemas', 'paramedir']
+
+    #Memory per input byte that is assumed before a tool has been measured
+    default_ratios = [0.5, 1.0, 1.0]
+
+    #Lower bound of the base footprint of the tools
+    minimum = 256 * 1024 * 1024
+
+    #Inputs below this size only measure the base footprint
+    size_floor = 64 * 1024 * 1024
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.condition = multiprocessing.Condition()
+        self.in_use = multiprocessing.Value('d', 0.0, lock=False)
+        self.bases = multiprocessing.Array('d', len(self.tools), lock=False)
+        #Negative until the first run on an input of at least size_floor
+        self.ratios = multiprocessing.Array('d', [-1.0] * len(self.tools), lock=False)
+
+    def estimate(self, tool, size):
+        """Returns the estimated peak RSS in bytes of tool for an input of size
+        bytes, or 0 for tools that are not controlled."""
+        if tool not in self.tools:
+            return 0
+        index = self.tools.index(tool)
+        with self.condition:
+            base = max(self.minimum, self.bases[index])
+            ratio = self.ratios[index]
+        if ratio >= 0:
+            #Add some headroom to the largest measured ratio
+            ratio *= 1.1
+        else:
+            ratio = self.default_ratios[index]
+        return int(min(self.budget, base + ratio * size))
+
+    def acquire(self, amount):
+        """Blocks until amount bytes fit into the budget and reserves them.
+        Returns the waiting time in seconds."""
+        time_wait = time.time()
+        with self.condition:
+            while self.in_use.value > 0 and self.in_use.value + amount > self.budget:
+                self.condition.wait()
+            self.in_use.value += amount
+        return time.time() - time_wait
+
+    def release(self, amount):
+        """Returns amount bytes to the budget and wakes up waiting tools."""
+        with self.condition:
+            self.in_use.value -= amount
+            self.condition.notify_all()
+
+    def record(self, tool, size, peak):
+        """Updates the history of tool with the measured peak RSS in bytes."""
+        if tool not in self.tools:
+            return
+        index = self.tools.index(tool)
+        with self.condition:
+            if size < self.size_floor:
+                self.bases[index] = max(self.bases[index], float(peak))
+            else:
+                base = max(self.minimum, self.bases[index])
+                self.ratios[index] = max(self.ratios[index], max(0.0, peak - base) / size)
+
+
+class RingBuffer(object):
+    """Keeps the last limit bytes that are written to it."""
+
+    def __init__(self, limit=64 * 1024):
+        self.limit = limit
+        self.chunks = deque()
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.size += len(data)
+        while self.size - len(self.chunks[0]) >= self.limit:
+            self.size -= len(self.chunks.popleft())
+
+    def getvalue(self):
+        return b''.join(self.chunks)[-self.limit:].decode('utf-8', 'replace')
+
+
+class CommandEngine(object):
+    """Runs external commands on an asyncio event loop in a background thread.
+    All threads of a process share one engine: run() submits a command to the
+    loop and blocks until it finished. The stdout and stderr of each command are
+    streamed into ring buffers, the command is killed after timeout seconds, when
+    the caller is interrupted, or by cancel_all, and the wall time, CPU time, and
+    peak RSS of the command are returned in its record.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.pid = os.getpid()
+        self.tasks = set()
+
+    def run(self, cmd, timeout=None):
+        """Runs cmd and returns its record, a dictionary with the command, the
+        return value, the wall and CPU time in seconds, the peak RSS in bytes,
+        and the tail of its stdout and stderr."""
+        future = asyncio.run_coroutine_threadsafe(self.execute(cmd, timeout), self.loop)
+        try:
+            return future.result()
+        except BaseException:
+            #Interrupted by the user or a signal: kill the child before leaving
+            future.cancel()
+            raise
+
+    def cancel_all(self):
+        """Kills all commands that are currently running, including those that
+        were started by other threads, and waits until they are reaped. The
+        killed commands return their record with the return value of SIGKILL."""
+        asyncio.run_coroutine_threadsafe(self.cancel_tasks(), self.loop).result()
+
+    async def cancel_tasks(self):
+        """Coroutine that cancels the commands of cancel_all."""
+        #Each command is cancelled once, so it is not interrupted while reaped
+        tasks = list(self.tasks)
+        self.tasks.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def execute(self, cmd, timeout):
+        """Coroutine that runs cmd on the event loop."""
+        self.tasks.add(asyncio.current_task())
+        record = {'cmd': cmd, 'return_value': None, 'timeout': False,
+                  'wall_time': 0.0, 'cpu_time': 0.0, 'maxrss': 0,
+                  'stdout': '', 'stderr': ''}
+        stdout = RingBuffer()
+        stderr = RingBuffer()
+
+        time_start = time.time()
+        try:
+            #Each command gets its own process group, so killing it also kills
+            #the processes it started, which would keep the pipes open
+            process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                       start_new_session=True)
+        except OSError as error:
+            record['return_value'] = 127
+            record['stderr'] = str(error)
+            self.tasks.discard(asyncio.current_task())
+            return record
+
+        readers = [asyncio.ensure_future(self.drain(process.stdout, stdout)),
+                   asyncio.ensure_future(self.drain(process.stderr, stderr))]
+
+        #The child is reaped with wait4 in a helper thread to get its rusage
+        waiter = self.loop.run_in_executor(None, os.wait4, process.pid, 0)
+        try:
+            try:
+                _, status, rusage = await asyncio.wait_for(asyncio.shield(waiter), timeout)
+            except asyncio.TimeoutError:
+                record['timeout'] = True
+                self.kill(process)
+                _, status, rusage = await waiter
+        except asyncio.CancelledError:
+            #An interrupted caller of run already left, so only cancel_all sees
+            #the record of the killed command
+            self.kill(process)
+            _, status, rusage = await waiter
+        finally:
+            await asyncio.gather(*readers, return_exceptions=True)
+            self.tasks.discard(asyncio.current_task())
+
+        if os.WIFSIGNALED(status):
+            process.returncode = -os.WTERMSIG(status)
+        else:
+            process.returncode = os.WEXITSTATUS(status)
+
+        record['return_value'] = process.returncode
+        record['wall_time'] = time.time() - time_start
+        record['cpu_time'] = rusage.ru_utime + rusage.ru_stime
+        #ru_maxrss is given in kilobytes on Linux and in bytes on macOS
+        record['maxrss'] = rusage.ru_maxrss if sys.platform == 'darwin' else rusage.ru_maxrss * 1024
+        record['stdout'] = stdout.getvalue()
+        record['stderr'] = stderr.getvalue()
+        return record
+
+    def kill(self, process):
+        """Kills the process group of a command that is not reaped yet."""
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    async def drain(self, pipe, buffer):
+        """Coroutine that copies the output of pipe into buffer."""
+        reader = asyncio.StreamReader()
+        transport, _ = await self.loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                buffer.write(data)
+        finally:
+            transport.close()
+
+
+#Command engine of the current process, see get_command_engine.
+command_engine = None
+command_engine_lock = threading.Lock()
+
+
+def get_command_engine():
+    """Returns the command engine of the current process. A forked worker
+    inherits the engine of its parent without the loop thread, so a new engine
+    is created per process. The Dimemas thread and the main thread of a worker
+    start their first commands together, so they must get the same engine for
+    cancel_all to see all commands."""
+    global command_engine
+    with command_engine_lock:
+        if command_engine is None or not command_engine.pid == os.getpid():
+            command_engine = CommandEngine()
+        return command_engine
+
+
+def run_command(cmd, input_size=0, admission=True):
+    """Runs a command and forwards the return value.
+    If a memory budget is set, the command is delayed until its estimated
+    memory, based on input_size bytes, fits into the budget. With admission
+    set to False, the caller already reserved the memory for the command.
+    """
+    if memory_budget:
+        memory = memory_budget.estimate(cmd[0], input_size)
+        if admission:
+            time_wait = memory_budget.acquire(memory)
+            if cmdl_args.debug and time_wait > 0.1:
+                print('==DEBUG== Waited {0:.1f} seconds for {1} of memory budget.'.format(time_wait, human_readable(memory)))
 
-    #In debug mode, keep the output. Otherwise, redirect it to devnull.
     if cmdl_args.debug:
-        out = tempfile.NamedTemporaryFile(suffix='.out', prefix=cmd[0]+'_', dir='./', delete=False)
-        err = tempfile.NamedTemporaryFile(suffix='.err', prefix=cmd[0]+'_', dir='./', delete=False)
-    else:
-        out = open(os.devnull, 'w')
-        err = open(os.devnull, 'w')
+        print('==DEBUG== Executing:', ' '.join(cmd))
 
-    return_value = subprocess.call(cmd, stdout=out, stderr=err)
+    try:
+        record = get_command_engine().run(cmd, cmdl_args.timeout)
+    finally:
+        if memory_budget and admission:
+            memory_budget.release(memory)
 
-    out.close
-    err.close
+    if memory_budget:
+        memory_budget.record(cmd[0], input_size, record['maxrss'])
 
-    if return_value == 0:
-        if cmdl_args.debug:
-            os.remove(out.name)
-            os.remove(err.name)
-    else:
+    if cmdl_args.debug:
+        line = '==DEBUG== Finished ' + cmd[0]
+        line += ' in {0:.1f} seconds ({1:.1f} seconds CPU time)'.format(record['wall_time'], record['cpu_time'])
+        line += ', peak memory ' + human_readable(record['maxrss'])
+        if memory_budget:
+            line += ', estimated ' + human_readable(memory)
+        print(line + '.')
+
+    return_value = record['return_value']
+    if record['timeout']:
+        print('==ERROR== ' + ' '.join(cmd) + ' exceeded the timeout of ' + str(cmdl_args.timeout) + ' seconds!')
+    elif not return_value == 0:
         print('==ERROR== ' + ' '.join(cmd) + ' failed with return value ' + str(return_value) + '!')
-        print('See ' + out.name + ' and ' + err.name + ' for more details.')
+
+    if not return_value == 0:
+        for stream in ['stdout', 'stderr']:
+            if record[stream].strip():
+                print('Last output on ' + stream + ':')
+                print(record[stream].rstrip())
 
     return return_value
 
@@ -366,7 +879,7 @@ def print_mod_factors_csv(mod_factors, trace_list, trace_processes):
             for trace in trace_list:
                 line += delimiter
                 try: #except NaN
-                    line += '{0:.2f}'.format(raw_data[raw_key][trace])
+                    line += '{0:.6f}'.format(raw_data[raw_key][trace])
                 except ValueError:
                     line += '{}'.format(raw_data[raw_key][trace])
             output.write(line + '\n')
@@ -374,12 +887,11 @@ def print_mod_factors_csv(mod_factors, trace_list, trace_processes):
     print('Model factors written to ' + file_path)
 
 
-def read_mod_factors_csv(cmdl_args):
+def read_mod_factors_csv(file_path, cmdl_args):
     """Reads the model factors table from a csv file."""
     global mod_factors_doc
 
     delimiter = ';'
-    file_path = cmdl_args.project
 
     #Read csv to list of lines
     if os.path.isfile(file_path) and file_path[-4:] == '.csv':
@@ -420,185 +932,831 @@ def read_mod_factors_csv(cmdl_args):
     return mod_factors, trace_list, trace_processes
 
 
+def get_projection_csvs(cmdl_args):
+    """Expands the paths given with -p to the list of csv files to project.
+    Patterns with wild cards are expanded like by the shell, and a directory
+    stands for all modelfactors.csv files below it, e.g. one per experiment.
+    Exits if a path is not a valid csv file or nothing is found.
+    """
+    csv_list = []
+    for path in cmdl_args.project:
+        if any(char in path for char in '*?['):
+            matches = sorted(glob.glob(path))
+        else:
+            matches = [path]
+        for match in matches:
+            if os.path.isdir(match):
+                for root, dirs, files in os.walk(match):
+                    dirs.sort()
+                    csv_list.extend(os.path.join(root, name) for name in sorted(files) if name == 'modelfactors.csv')
+            elif os.path.isfile(match) and match[-4:] == '.csv':
+                csv_list.append(match)
+            else:
+                print('==ERROR==', match, 'is not a valid csv file.')
+                sys.exit(1)
 
+    #Remove duplicates of overlapping paths, keeping the order
+    csv_list = list(OrderedDict.fromkeys(csv_list))
+
+    if not csv_list:
+        print('==ERROR== could not find any modelfactors.csv matching', ' '.join(cmdl_args.project))
+        sys.exit(1)
+
+    return csv_list
+
+
+def read_raw_data_csv(file_path):
+    """Reads the raw data that print_mod_factors_csv stores in the lines
+    starting with # of the given csv file. Like read_mod_factors_csv, each
+    stored trace is named after its number of processes. Returns the raw data,
+    the list of stored traces, and the dictionary with their number of
+    processes. The raw data is None if the file does not contain it, e.g. if
+    it was written by an older version."""
+    global raw_data_doc
+
+    delimiter = ';'
+
+    #Read csv to list of lines
+    if os.path.isfile(file_path) and file_path[-4:] == '.csv':
+        with open(file_path, 'r') as f:
+            lines = f.readlines()
+        lines = [line.rstrip('\n') for line in lines]
+    else:
+        print('==ERROR==', file_path, 'is not a valid csv file.')
+        sys.exit(1)
+
+    #Get the number of processes of the traces
+    processes = lines[0].split(delimiter)
+    processes.pop(0)
+
+    #Create artificial trace_list and trace_processes
+    trace_list = []
+    trace_processes = dict()
+    for process in processes:
+        trace_list.append(process)
+        trace_processes[process] = int(process)
 
-def gather_raw_data(trace_list, trace_processes, cmdl_args):
-    """Gathers all raw data needed to generate the model factors. Return raw
-    data in a 2D dictionary <data type><list of values for each trace>"""
     raw_data = create_raw_data(trace_list)
 
+    #Find the raw data lines by their printable name
+    raw_data_keys = dict((raw_data_doc[key], key) for key in raw_data_doc)
+    found = set()
+    for line in lines:
+        line = line.split(delimiter)
+        if not line[0][1:] in raw_data_keys or not line[0][:1] == '#':
+            continue
+        key = raw_data_keys[line[0][1:]]
+        found.add(key)
+        for index, trace in enumerate(trace_list):
+            try: #except NaN
+                raw_data[key][trace] = float(line[index+1])
+                if key in counter_event_types:
+                    raw_data[key][trace] = int(raw_data[key][trace])
+            except (ValueError, IndexError):
+                raw_data[key][trace] = 'NaN'
+
+    if not found == set(raw_data_doc):
+        raw_data = None
+
+    return raw_data, trace_list, trace_processes
+
+
+def get_projection_scaling(raw_data, trace_list, trace_processes, cmdl_args):
+    """Returns the scaling type of a series read from a csv file, see
+    get_scaling_type. Without raw data or without useful instructions for
+    every trace, the scaling given with --scaling is used, or strong scaling
+    for auto."""
+    if raw_data is not None and all(float(raw_data['useful_ins'][trace]) > 0 for trace in trace_list):
+        return get_scaling_type(raw_data, trace_list, trace_processes, cmdl_args)
+    if cmdl_args.scaling == 'auto':
+        return 'strong'
+    return cmdl_args.scaling
+
+
+def get_reference_runtime(raw_data, trace_list):
+    """Returns the runtime of the smallest trace in seconds, or None if the raw
+    data or the runtime is not available."""
+    if raw_data is None:
+        return None
+    try: #except NaN
+        runtime = float(raw_data['runtime'][trace_list[0]]) / 1000000
+    except ValueError:
+        return None
+    if not runtime > 0:
+        return None
+    return runtime
+
+
+def merge_raw_data(stored, raw_data, trace_list, trace_processes):
+    """Merges the raw data of the series stored in a csv file, as returned by
+    read_raw_data_csv, with the raw data of the analyzed traces. An analyzed
+    trace replaces the stored trace with the same number of processes.
+    Returns the merged raw data, trace list sorted by the number of processes,
+    and the dictionary with the number of processes."""
+    stored_data, stored_list, stored_processes = stored
+
+    merged_list = list(trace_list)
+    merged_processes = dict(trace_processes)
+    merged_data = dict((key, dict(raw_data[key])) for key in raw_data)
+    for trace in stored_list:
+        if stored_processes[trace] in trace_processes.values():
+            print('Replacing the stored raw data of ' + trace + ' processes.')
+            continue
+        merged_list.append(trace)
+        merged_processes[trace] = stored_processes[trace]
+        for key in stored_data:
+            merged_data[key][trace] = stored_data[key][trace]
+
+    merged_list = sorted(merged_list, key=lambda trace: merged_processes[trace])
+    print('Appended ' + str(len(trace_list)) + ' traces to the stored series of ' + str(len(stored_list)) + ' traces.')
+    print('')
+    return merged_data, merged_list, merged_processes
+
+
+
+
+def get_cfgs():
+    """Returns a dictionary with the paths to the paramedir configurations."""
     cfgs = {}
     cfgs['root_dir']      = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'cfgs')
     cfgs['timings']       = os.path.join(cfgs['root_dir'], 'timings.cfg')
     cfgs['runtime']       = os.path.join(cfgs['root_dir'], 'runtime.cfg')
     cfgs['cycles']        = os.path.join(cfgs['root_dir'], 'cycles.cfg')
     cfgs['instructions']  = os.path.join(cfgs['root_dir'], 'instructions.cfg')
+    return cfgs
+
+
+def get_cache_dir(cmdl_args):
+    """Returns the directory of the raw data cache."""
+    if cmdl_args.cache_dir:
+        return cmdl_args.cache_dir
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'modelfactors')
+
+
+def get_trace_fingerprint(trace, samples=16, sample_size=64 * 1024):
+    """Returns a fingerprint of the trace that is fast to compute: the size,
+    the modification time, and the hash of samples blocks of sample_size bytes
+    spread evenly over the trace, including the first and the last block."""
+    stat = os.stat(trace)
+    digest = hashlib.sha256()
+    with open(trace, 'rb') as f:
+        for sample in range(samples):
+            f.seek(max(0, stat.st_size - sample_size) * sample // (samples - 1))
+            digest.update(f.read(sample_size))
+    return '{0}:{1}:{2}'.format(stat.st_size, stat.st_mtime_ns, digest.hexdigest())
+
+
+def get_file_hash(path):
+    """Returns the hash of the content of the file."""
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def get_tool_identity(tool):
+    """Identifies the installed tool by path, size, and modification time of
+    its binary, as the tools have no common option to print their version."""
+    path = which(tool)
+    if not path:
+        return tool + ':missing'
+    stat = os.stat(os.path.realpath(path))
+    return '{0}:{1}:{2}'.format(os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+
+
+def get_cache_context(cfgs, cmdl_args):
+    """Returns the hash of everything besides the trace that determines the
+    raw data: the paramedir and Dimemas configurations, the installed tools,
+    the reader, and the collected raw data."""
+    context = [get_file_hash(cfgs[cfg]) for cfg in ['timings', 'runtime', 'cycles', 'instructions']]
+    context += [get_file_hash(os.path.join(cfgs['root_dir'], cfg)) for cfg in ['dimemas_ideal.cfg', 'dimemas.collectives']]
+    context += [get_tool_identity(tool) for tool in ['paramedir', 'prv2dim', 'Dimemas']]
+    context += ['native' if cmdl_args.reader == 'native' else 'paramedir']
+    context += list(raw_data_doc)
+    return hashlib.sha256(' '.join(context).encode()).hexdigest()
+
+
+def get_cache_entry(fingerprint, processes, context, cmdl_args):
+    """Returns the path of the cache entry of the trace with the given
+    fingerprint, see get_trace_fingerprint, analyzed with the given number of
+    processes in the given context, see get_cache_context."""
+    key = hashlib.sha256(':'.join([context, str(processes), fingerprint]).encode()).hexdigest()
+    return os.path.join(get_cache_dir(cmdl_args), key + '.json')
+
+
+#Raw data that is computed from the simulated ideal trace
+dimemas_raw_data = ['useful_dim', 'runtime_dim']
+
+
+def get_dimemas_cache_entry(fingerprint, processes, cfgs, cmdl_args):
+    """Returns the path of the cache entry of the results of the simulated
+    ideal trace, i.e. dimemas_raw_data, of the trace with the given
+    fingerprint. They only depend on the trace, the
+    rendered Dimemas configuration, prv2dim and Dimemas, and the analysis of
+    the simulated trace, so they remain valid when other parts of the analysis
+    change."""
+    context = ['dimemas', fingerprint, render_dimemas_cfg(processes)]
+    context += [get_file_hash(os.path.join(cfgs['root_dir'], 'dimemas.collectives'))]
+    context += [get_tool_identity(tool) for tool in ['prv2dim', 'Dimemas']]
+    if cmdl_args.reader == 'native':
+        context += ['native']
+    else:
+        context += [get_file_hash(cfgs['timings']), get_file_hash(cfgs['runtime']), get_tool_identity('paramedir')]
+    key = hashlib.sha256(' '.join(context).encode()).hexdigest()
+    return os.path.join(get_cache_dir(cmdl_args), key + '.json')
+
+
+def read_cache(entry, keys):
+    """Returns the raw data stored in the cache entry, or None if there is no
+    such entry or if it does not hold exactly the given keys. Marks the entry as
+    recently used."""
+    try:
+        with open(entry) as f:
+            trace_data = json.load(f)['raw_data']
+        os.utime(entry)
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+    if not set(trace_data) == set(keys):
+        return None
+    return trace_data
+
+
+def write_cache(entry, trace, trace_data):
+    """Stores the raw data of the trace in the cache entry. Raw data with
+    missing values, e.g. after a tool failed, is not stored. The entry is
+    written to a temporary file and renamed, so concurrent runs never see a
+    partial entry."""
+    if 'NaN' in trace_data.values():
+        return
+    temporary = entry + '.' + str(os.getpid()) + '.tmp'
+    try:
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        with open(temporary, 'w') as f:
+            json.dump({'trace': os.path.abspath(trace), 'raw_data': trace_data}, f)
+        os.replace(temporary, entry)
+    except (IOError, OSError) as error:
+        print('==Warning== Could not write cache entry ' + entry + ' (' + str(error) + ').')
+        save_remove(temporary)
+
+
+def evict_cache(cmdl_args):
+    """Removes the least recently used cache entries until the cache fits into
+    --cache-size. Only the entries of the raw data in the cache directory
+    itself are counted, not the metadata records in its subdirectory."""
+    cache_dir = get_cache_dir(cmdl_args)
+    try:
+        entries = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith('.json')]
+    except OSError:
+        return
+
+    stats = []
+    for entry in entries:
+        try:
+            stats.append((os.stat(entry), entry))
+        except OSError:
+            pass
+    total = sum(stat.st_size for stat, entry in stats)
+    for stat, entry in sorted(stats, key=lambda item: item[0].st_mtime):
+        if total <= cmdl_args.cache_size:
+            break
+        save_remove(entry)
+        total -= stat.st_size
+
+
+def get_checkpoint_path():
+    """Returns the path of the checkpoint file, which is stored in the
+    execution directory like modelfactors.csv."""
+    return os.path.join(os.getcwd(), 'modelfactors.checkpoint.json')
+
+
+def read_checkpoint():
+    """Returns the finished traces stored in the checkpoint file as dictionary
+    <absolute trace path><processes, fingerprint, raw_data>, which is empty
+    if there is no valid checkpoint."""
+    try:
+        with open(get_checkpoint_path()) as f:
+            return json.load(f)['traces']
+    except (IOError, OSError, ValueError, KeyError):
+        return dict()
+
+
+def write_checkpoint(checkpoint):
+    """Writes the finished traces to the checkpoint file. The file is written
+    to a temporary file and renamed, so an interruption never leaves a partial
+    checkpoint behind. Failures only print a warning, e.g. in read-only
+    execution directories, since the checkpoint is only needed for --resume."""
+    file_path = get_checkpoint_path()
+    temporary = file_path + '.tmp'
+    try:
+        with open(temporary, 'w') as f:
+            json.dump({'traces': checkpoint}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, file_path)
+    except (IOError, OSError) as error:
+        print('==Warning== Could not write checkpoint ' + file_path + ' (' + str(error) + ').')
+        save_remove(temporary)
+
+
+def remove_checkpoint():
+    """Removes the checkpoint file after the run has finished."""
+    if os.path.exists(get_checkpoint_path()):
+        save_remove(get_checkpoint_path())
+
+
+def remove_incomplete_outputs(trace):
+    """Removes the files that an interrupted analysis of the trace can leave
+    behind: the Dimemas translation and configuration, the simulated trace,
+    the paramedir output, and temporary index files."""
+    trace_base = get_trace_base(trace)
+    suffixes = ['.dim', '.dimemas_ideal.cfg', '.sim.prv']
+    suffixes += ['.' + cfg + '.stats' for cfg in ['timings', 'runtime', 'cycles', 'instructions']]
+    suffixes += ['.sim.' + cfg + '.stats' for cfg in ['timings', 'runtime']]
+    leftovers = [trace_base + suffix for suffix in suffixes]
+
+    directory = os.path.dirname(trace) or '.'
+    for name in os.listdir(directory):
+        if fnmatch.fnmatch(name, os.path.basename(get_index_name(trace)) + '.*.tmp') or \
+           fnmatch.fnmatch(name, os.path.basename(get_index_name(trace_base + '.sim.prv')) + '*'):
+            leftovers.append(os.path.join(directory, name))
+
+    for leftover in leftovers:
+        if os.path.exists(leftover):
+            print('Removing incomplete output ' + leftover)
+            save_remove(leftover)
+
+
+def gather_raw_data(trace_list, trace_processes, cmdl_args):
+    """Gathers all raw data needed to generate the model factors. Return raw
+    data in a 2D dictionary <data type><list of values for each trace>
+    The raw data of traces that have been analyzed before is taken from the
+    cache, see get_cache_entry, unless --no-cache or --refresh is given.
+    The raw data of each finished trace is committed to a checkpoint file, so
+    an interrupted run can be continued with --resume."""
+    raw_data = create_raw_data(trace_list)
+    cfgs = get_cfgs()
+
+    #Take the raw data of the traces that an interrupted run finished
+    previous = read_checkpoint() if cmdl_args.resume else dict()
+    checkpoint = dict()
+
+    #Take the raw data of unchanged traces from the cache
+    #The fingerprint samples the trace, so it is computed once per trace for
+    #the checkpoint and the cache entries
+    fingerprints = dict((trace, get_trace_fingerprint(trace)) for trace in trace_list)
+    cache_entries = dict()
+    pending = []
+    if not cmdl_args.no_cache:
+        context = get_cache_context(cfgs, cmdl_args)
+    for trace in trace_list:
+        trace_data = None
+        entry = previous.get(os.path.abspath(trace))
+        if entry and entry['processes'] == trace_processes[trace] and \
+           entry['fingerprint'] == fingerprints[trace] and \
+           not 'NaN' in entry['raw_data'].values():
+            trace_data = entry['raw_data']
+            print('Using raw data of ' + os.path.basename(trace) + ' from the checkpoint.')
+        if not cmdl_args.no_cache:
+            cache_entries[trace] = get_cache_entry(fingerprints[trace], trace_processes[trace], context, cmdl_args)
+            if not cmdl_args.refresh and not trace_data:
+                trace_data = read_cache(cache_entries[trace], raw_data_doc)
+                if trace_data:
+                    print('Using cached raw data for ' + os.path.basename(trace) + '.')
+        if trace_data:
+            for key in trace_data:
+                raw_data[key][trace] = trace_data[key]
+            checkpoint[os.path.abspath(trace)] = {'processes': trace_processes[trace],
+                                                  'fingerprint': fingerprints[trace],
+                                                  'raw_data': trace_data}
+        else:
+            if cmdl_args.resume:
+                remove_incomplete_outputs(trace)
+            pending.append(trace)
+    if len(pending) < len(trace_list):
+        print('')
+    write_checkpoint(checkpoint)
+
+    def store(trace, trace_data):
+        for key in trace_data:
+            raw_data[key][trace] = trace_data[key]
+        if trace in cache_entries:
+            write_cache(cache_entries[trace], trace, trace_data)
+        checkpoint[os.path.abspath(trace)] = {'processes': trace_processes[trace],
+                                              'fingerprint': fingerprints[trace],
+                                              'raw_data': trace_data}
+        write_checkpoint(checkpoint)
 
     #Main loop over all traces
-    #This can be parallized: the loop iterations have no dependencies
+    #The loop iterations have no dependencies, so with --jobs the traces are
+    #distributed over a pool of worker processes.
+    if cmdl_args.jobs > 1 and len(pending) > 1:
+        slots = min(cmdl_args.jobs, len(pending))
+        schedule = plan_schedule(pending, trace_processes, slots)
+        tasks = [(trace, trace_processes[trace], fingerprints[trace], cfgs) for trace in schedule['order']]
+
+        if cmdl_args.debug:
+            print('==DEBUG== Analyzing ' + str(len(pending)) + ' traces with ' + str(slots) + ' parallel jobs.')
+            print('==DEBUG== Scheduling order: ' + ', '.join(os.path.basename(trace) for trace in schedule['order']))
+            print('')
+
+        #Each idle worker fetches the next trace in longest-first order, which
+        #is the list scheduling that plan_schedule simulates.
+        time_start = time.time()
+        pool = multiprocessing.Pool(slots, initializer=init_worker, initargs=(cmdl_args, memory_budget))
+        try:
+            #Print the output of each trace as a whole as soon as it is finished
+            for trace, trace_data, output, timing in pool.imap_unordered(analyze_trace_buffered, tasks):
+                sys.stdout.write(output)
+                sys.stdout.flush()
+                store(trace, trace_data)
+                schedule['actual'][trace] = timing
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        print_schedule(schedule, time_start)
+    else:
+        for trace in pending:
+            trace_data = analyze_trace(trace, trace_processes[trace], fingerprints[trace], cfgs, cmdl_args)
+            store(trace, trace_data)
+
+    if not cmdl_args.no_cache:
+        evict_cache(cmdl_args)
+
+    return raw_data
+
+
+def get_trace_cost(trace, processes):
+    """Estimates the relative analysis cost of a trace. The cost is dominated by
+    the uncompressed trace size, which all tools have to read, plus a constant
+    overhead per process for the Dimemas simulation and the paramedir rows."""
+    cost_per_process = 1024 * 1024
+    return get_trace_size(trace) + processes * cost_per_process
+
+
+def plan_schedule(trace_list, trace_processes, slots):
+    """Plans the distribution of the traces onto the given number of slots.
+    Orders the traces longest-first and assigns each trace to the slot that
+    becomes idle first (LPT list scheduling), which bounds the makespan to 4/3
+    of the optimum. Returns a dictionary with the execution order, the planned
+    slot, start, and end of each trace in cost units, and an empty dictionary
+    for the actual timings.
+    """
+    costs = dict()
     for trace in trace_list:
-        time_tot = time.time()
+        costs[trace] = get_trace_cost(trace, trace_processes[trace])
+
+    order = sorted(trace_list, key=lambda trace: (costs[trace], trace_processes[trace]), reverse=True)
+
+    planned = dict()
+    idle_slots = [(0, slot) for slot in range(slots)]
+    heapq.heapify(idle_slots)
+    for trace in order:
+        start, slot = heapq.heappop(idle_slots)
+        planned[trace] = (slot, start, start + costs[trace])
+        heapq.heappush(idle_slots, (start + costs[trace], slot))
+
+    return {'order': order, 'costs': costs, 'planned': planned, 'actual': dict()}
+
+
+def print_schedule(schedule, time_start):
+    """Prints the planned versus the actual schedule of a parallel run.
+    The planned times are converted from cost units to seconds with the average
+    throughput that was measured over all traces.
+    """
+    order = schedule['order']
+    actual = schedule['actual']
+    if not len(actual) == len(order):
+        return
 
-        line = 'Analyzing ' + os.path.basename(trace)
-        line += ' (' + str(trace_processes[trace]) + ' processes'
-        line += ', ' + human_readable( os.path.getsize( trace ) ) + ')'
+    #Map the worker processes to slots in order of their first trace
+    workers = []
+    for trace in sorted(order, key=lambda trace: actual[trace][1]):
+        if actual[trace][0] not in workers:
+            workers.append(actual[trace][0])
+
+    busy_time = sum(actual[trace][2] - actual[trace][1] for trace in order)
+    total_cost = sum(schedule['costs'][trace] for trace in order)
+    seconds_per_cost = busy_time / total_cost if total_cost else 0.0
+
+    print('Schedule of the parallel analysis (planned vs. actual):')
+    longest_name = max(len(os.path.basename(trace)) for trace in order)
+    line = 'Trace'.ljust(longest_name)
+    line += ' | ' + 'Planned slot, start - end (s)'.rjust(32)
+    line += ' | ' + 'Actual slot, start - end (s)'.rjust(32)
+    print(line)
+    print(''.ljust(len(line), '='))
+
+    planned_makespan = 0.0
+    actual_makespan = 0.0
+    for trace in order:
+        slot, start, end = schedule['planned'][trace]
+        planned_start = start * seconds_per_cost
+        planned_end = end * seconds_per_cost
+        planned_makespan = max(planned_makespan, planned_end)
+
+        worker, act_start, act_end = actual[trace]
+        act_start -= time_start
+        act_end -= time_start
+        actual_makespan = max(actual_makespan, act_end)
+
+        line = os.path.basename(trace).ljust(longest_name)
+        line += ' | ' + '{0:d}, {1:.1f} - {2:.1f}'.format(slot, planned_start, planned_end).rjust(32)
+        line += ' | ' + '{0:d}, {1:.1f} - {2:.1f}'.format(workers.index(worker), act_start, act_end).rjust(32)
         print(line)
 
-        #Create simulated ideal trace with Dimemas
+    print('Planned makespan {0:.1f} seconds, actual makespan {1:.1f} seconds.'.format(planned_makespan, actual_makespan))
+    print('')
+
+
+def init_worker(args, budget):
+    """Initializes a worker process of the trace pool. The command line
+    arguments and the memory budget are used as globals by run_command and
+    save_remove, so they are set explicitly for platforms that do not fork the
+    main process."""
+    global cmdl_args, memory_budget
+    cmdl_args = args
+    memory_budget = budget
+
+    #Pool.terminate sends SIGTERM; exit through Python to kill running tools
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+
+
+def analyze_trace_buffered(task):
+    """Runs analyze_trace in a worker process and captures its console output,
+    so the output of each trace is printed together by the main process.
+    Returns the trace, its raw data, the captured output, and a tuple with the
+    worker process id and the start and end time of the analysis.
+    """
+    trace, processes, fingerprint, cfgs = task
+
+    output = StringIO()
+    stdout = sys.stdout
+    sys.stdout = output
+    time_start = time.time()
+    try:
+        trace_data = analyze_trace(trace, processes, fingerprint, cfgs, cmdl_args)
+    except BaseException:
+        #Pool.terminate or an interrupt: kill the tools of all threads
+        get_command_engine().cancel_all()
+        raise
+    finally:
+        sys.stdout = stdout
+    time_end = time.time()
+
+    return trace, trace_data, output.getvalue(), (os.getpid(), time_start, time_end)
+
+
+def analyze_trace(trace, processes, fingerprint, cfgs, cmdl_args):
+    """Runs Dimemas and paramedir for a single trace and parses the results.
+    The fingerprint of the trace, see get_trace_fingerprint, identifies the
+    cached results of the simulated trace.
+    Returns a dictionary <data type><value> with the raw data of the trace."""
+    trace_data = dict.fromkeys(raw_data_doc, 0)
+    trace_base = get_trace_base(trace)
+
+    time_tot = time.time()
+
+    line = 'Analyzing ' + os.path.basename(trace)
+    line += ' (' + str(processes) + ' processes'
+    line += ', ' + human_readable( os.path.getsize( trace ) ) + ')'
+    print(line)
+
+    #Take the results of the simulated ideal trace from the cache, if possible
+    dim_entry = None
+    dim_data = None
+    if not cmdl_args.no_cache:
+        dim_entry = get_dimemas_cache_entry(fingerprint, processes, cfgs, cmdl_args)
+        if not cmdl_args.refresh:
+            dim_data = read_cache(dim_entry, dimemas_raw_data)
+
+    #Create simulated ideal trace with Dimemas in a separate thread.
+    #The analysis of the original trace does not depend on the simulation, so
+    #paramedir runs on the original trace meanwhile.
+    ideal = {'trace_sim': '', 'time': 0.0}
+
+    def simulate():
         time_dim = time.time()
-        trace_sim = create_ideal_trace(trace, trace_processes[trace], cmdl_args)
-        time_dim = time.time() - time_dim
-        if not trace_sim == '':
-            print('Successfully created simulated trace with Dimemas in {0:.1f} seconds.'.format(time_dim))
-        else:
-            print('Failed to create simulated trace with Dimemas.')
+        ideal['trace_sim'] = create_ideal_trace(trace, processes, cmdl_args)
+        ideal['time'] = time.time() - time_dim
+
+    thread_dim = threading.Thread(target=simulate)
+    if not dim_data:
+        thread_dim.start()
 
-        #Run paramedir for the original and simulated trace
+    try:
+        #Run paramedir for the original trace, unless the native reader computes
+        #all values
         time_pmd = time.time()
-        cmd_normal = ['paramedir', trace]
-        cmd_normal.extend([cfgs['timings'],      trace[:-4] + '.timings.stats'])
-        cmd_normal.extend([cfgs['runtime'],      trace[:-4] + '.runtime.stats'])
-        cmd_normal.extend([cfgs['cycles'],       trace[:-4] + '.cycles.stats'])
-        cmd_normal.extend([cfgs['instructions'], trace[:-4] + '.instructions.stats'])
+        if not cmdl_args.reader == 'native':
+            with TraceStream(trace, cmdl_args) as trace_plain:
+                cmd_normal = ['paramedir', trace_plain]
+                cmd_normal.extend([cfgs['timings'],      trace_base + '.timings.stats'])
+                cmd_normal.extend([cfgs['runtime'],      trace_base + '.runtime.stats'])
+                cmd_normal.extend([cfgs['cycles'],       trace_base + '.cycles.stats'])
+                cmd_normal.extend([cfgs['instructions'], trace_base + '.instructions.stats'])
+                run_command(cmd_normal, get_trace_size(trace))
+        time_pmd = time.time() - time_pmd
+
+        #Read the original trace with the native reader
+        if not cmdl_args.reader == 'paramedir':
+            time_nat = time.time()
+            native_data = read_trace_native(trace, cmdl_args.reader_jobs, not cmdl_args.no_index)
+            time_nat = time.time() - time_nat
+            print('Successfully read trace with the native reader in {0:.1f} seconds.'.format(time_nat))
 
+        #Wait for Dimemas before analyzing the simulated trace
+        if dim_data:
+            print('Using cached results of the simulated trace.')
+        else:
+            thread_dim.join()
+            if not ideal['trace_sim'] == '':
+                print('Successfully created simulated trace with Dimemas in {0:.1f} seconds.'.format(ideal['time']))
+            else:
+                print('Failed to create simulated trace with Dimemas.')
+    finally:
+        #On an interrupt or error, kill the tools of the Dimemas thread, which
+        #may still start the next one, before waiting for it
+        while thread_dim.is_alive():
+            get_command_engine().cancel_all()
+            thread_dim.join(0.5)
+
+    trace_sim = ideal['trace_sim']
+
+    #Run paramedir or the native reader for the simulated trace
+    if not trace_sim == '' and not cmdl_args.reader == 'native':
+        time_sim = time.time()
         cmd_ideal = ['paramedir', trace_sim]
         cmd_ideal.extend([cfgs['timings'],       trace_sim[:-4] + '.timings.stats'])
         cmd_ideal.extend([cfgs['runtime'],       trace_sim[:-4] + '.runtime.stats'])
+        run_command(cmd_ideal, os.path.getsize(trace_sim))
+        time_pmd += time.time() - time_sim
 
-        run_command(cmd_normal)
+    if not cmdl_args.reader == 'paramedir' and not dim_data:
         if not trace_sim == '':
-            run_command(cmd_ideal)
-
-        time_pmd = time.time() - time_pmd
-
-        error_timing = 0;
-        error_counters = 0;
-        error_ideal = 0;
-
-        #Check if all files are created
-        if not os.path.exists(trace[:-4] + '.timings.stats') or \
-           not os.path.exists(trace[:-4] + '.runtime.stats'):
-            print('==ERROR== Failed to compute timing information with paramedir.')
-            error_timing = 1
-
-        if not os.path.exists(trace[:-4] + '.cycles.stats') or \
-           not os.path.exists(trace[:-4] + '.instructions.stats'):
-            print('==ERROR== Failed to compute counter information with paramedir.')
-            error_counters = 1
-
-        if not os.path.exists(trace_sim[:-4] + '.timings.stats') or \
-           not os.path.exists(trace_sim[:-4] + '.runtime.stats'):
-            print('==ERROR== Failed to compute timing information with paramedir.')
-            error_ideal = 1
-            trace_sim = ''
-
-        if error_timing or error_counters or error_ideal:
-            print('Failed to analyze trace with paramedir in {0:.1f} seconds.'.format(time_pmd))
-        else:
-            print('Successfully analyzed trace with paramedir in {0:.1f} seconds.'.format(time_pmd))
-
-
-        #Parse the paramedir output files
-        time_prs = time.time()
-
-        #Get total, average, and maximum useful duration
-        if os.path.exists(trace[:-4] + '.timings.stats'):
-            content = []
-            with open(trace[:-4] + '.timings.stats') as f:
-                content = f.readlines()
-
-            for line in content:
-                if line.split():
-                    if line.split()[0] == 'Total':
-                        raw_data['useful_tot'][trace] = float(line.split()[1])
-                    if line.split()[0] == 'Average':
-                        raw_data['useful_avg'][trace] = float(line.split()[1])
-                    if line.split()[0] == 'Maximum':
-                        raw_data['useful_max'][trace] = float(line.split()[1])
-        else:
-            raw_data['useful_tot'][trace] = 'NaN'
-            raw_data['useful_avg'][trace] = 'NaN'
-            raw_data['useful_max'][trace] = 'NaN'
-
-        #Get runtime
-        if os.path.exists(trace[:-4] + '.runtime.stats'):
-            content = []
-            with open(trace[:-4] + '.runtime.stats') as f:
-                content = f.readlines()
-
-            for line in content:
-                if line.split():
-                    if line.split()[0] == 'Average':
-                        raw_data['runtime'][trace] = float(line.split()[1])
-        else:
-            raw_data['runtime'][trace] = 'NaN'
-
-        #Get useful cycles
-        if os.path.exists(trace[:-4] + '.cycles.stats'):
-            content = []
-            with open(trace[:-4] + '.cycles.stats') as f:
-                content = f.readlines()
-
-            for line in content:
-                if line.split():
-                    if line.split()[0] == 'Total':
-                        raw_data['useful_cyc'][trace] = int(float(line.split()[1]))
-        else:
-            raw_data['useful_cyc'][trace] = 'NaN'
-
-        #Get useful instructions
-        if os.path.exists(trace[:-4] + '.instructions.stats'):
-            content = []
-            with open(trace[:-4] + '.instructions.stats') as f:
-                content = f.readlines()
-
-            for line in content:
-                if line.split():
-                    if line.split()[0] == 'Total':
-                        raw_data['useful_ins'][trace] = int(float(line.split()[1]))
+            #The simulated trace is created again on every run, so it gets no index
+            native_sim = read_trace_native(trace_sim, cmdl_args.reader_jobs, False)
+            native_data['useful_dim'] = native_sim['useful_max']
+            native_data['runtime_dim'] = native_sim['runtime']
         else:
-            raw_data['useful_ins'][trace] ='NaN'
-
-        #Get maximum useful duration for simulated trace
-        if os.path.exists(trace_sim[:-4] + '.timings.stats'):
-            content = []
-            with open(trace_sim[:-4] + '.timings.stats') as f:
-                content = f.readlines()
-
-            for line in content:
-                if line.split():
-                    if line.split()[0] == 'Maximum':
-                        raw_data['useful_dim'][trace] = float(line.split()[1])
-        else:
-            raw_data['useful_dim'][trace] = 'NaN'
-
-        #Get runtime for simulated trace
-        if os.path.exists(trace_sim[:-4] + '.runtime.stats'):
-            content = []
-            with open(trace_sim[:-4] + '.runtime.stats') as f:
-                content = f.readlines()
-
-            for line in content:
-                if line.split():
-                    if line.split()[0] == 'Average':
-                        raw_data['runtime_dim'][trace] = float(line.split()[1])
-        else:
-            raw_data['runtime_dim'][trace] = 'NaN'
-
-        #Remove paramedir output files
-        save_remove(trace[:-4] + '.timings.stats')
-        save_remove(trace[:-4] + '.runtime.stats')
-        save_remove(trace[:-4] + '.cycles.stats')
-        save_remove(trace[:-4] + '.instructions.stats')
+            native_data['useful_dim'] = 'NaN'
+            native_data['runtime_dim'] = 'NaN'
+
+    error_timing = 0;
+    error_counters = 0;
+    error_ideal = 0;
+
+    #Check if all files are created
+    if cmdl_args.reader == 'native':
+        pass
+    elif not os.path.exists(trace_base + '.timings.stats') or \
+       not os.path.exists(trace_base + '.runtime.stats'):
+        print('==ERROR== Failed to compute timing information with paramedir.')
+        error_timing = 1
+
+    if cmdl_args.reader == 'native':
+        pass
+    elif not os.path.exists(trace_base + '.cycles.stats') or \
+       not os.path.exists(trace_base + '.instructions.stats'):
+        print('==ERROR== Failed to compute counter information with paramedir.')
+        error_counters = 1
+
+    if dim_data:
+        pass
+    elif cmdl_args.reader == 'native':
+        error_ideal = trace_sim == ''
+    elif trace_sim == '' or \
+       not os.path.exists(trace_sim[:-4] + '.timings.stats') or \
+       not os.path.exists(trace_sim[:-4] + '.runtime.stats'):
+        print('==ERROR== Failed to compute timing information with paramedir.')
+        error_ideal = 1
+        trace_sim = ''
+
+    if cmdl_args.reader == 'native':
+        pass
+    elif error_timing or error_counters or error_ideal:
+        print('Failed to analyze trace with paramedir in {0:.1f} seconds.'.format(time_pmd))
+    else:
+        print('Successfully analyzed trace with paramedir in {0:.1f} seconds.'.format(time_pmd))
+
+
+    #Parse the paramedir output files
+    time_prs = time.time()
+
+    #Get total, average, and maximum useful duration
+    if os.path.exists(trace_base + '.timings.stats'):
+        content = []
+        with open(trace_base + '.timings.stats') as f:
+            content = f.readlines()
+
+        for line in content:
+            if line.split():
+                if line.split()[0] == 'Total':
+                    trace_data['useful_tot'] = float(line.split()[1])
+                if line.split()[0] == 'Average':
+                    trace_data['useful_avg'] = float(line.split()[1])
+                if line.split()[0] == 'Maximum':
+                    trace_data['useful_max'] = float(line.split()[1])
+    else:
+        trace_data['useful_tot'] = 'NaN'
+        trace_data['useful_avg'] = 'NaN'
+        trace_data['useful_max'] = 'NaN'
+
+    #Get runtime
+    if os.path.exists(trace_base + '.runtime.stats'):
+        content = []
+        with open(trace_base + '.runtime.stats') as f:
+            content = f.readlines()
+
+        for line in content:
+            if line.split():
+                if line.split()[0] == 'Average':
+                    trace_data['runtime'] = float(line.split()[1])
+    else:
+        trace_data['runtime'] = 'NaN'
+
+    #Get useful cycles
+    if os.path.exists(trace_base + '.cycles.stats'):
+        content = []
+        with open(trace_base + '.cycles.stats') as f:
+            content = f.readlines()
+
+        for line in content:
+            if line.split():
+                if line.split()[0] == 'Total':
+                    trace_data['useful_cyc'] = int(float(line.split()[1]))
+    else:
+        trace_data['useful_cyc'] = 'NaN'
+
+    #Get useful instructions
+    if os.path.exists(trace_base + '.instructions.stats'):
+        content = []
+        with open(trace_base + '.instructions.stats') as f:
+            content = f.readlines()
+
+        for line in content:
+            if line.split():
+                if line.split()[0] == 'Total':
+                    trace_data['useful_ins'] = int(float(line.split()[1]))
+    else:
+        trace_data['useful_ins'] ='NaN'
+
+    #Get maximum useful duration for simulated trace
+    #Without simulated trace, e.g. for cached results, there are no stats and
+    #trace_sim[:-4] would point to the working directory
+    if not trace_sim == '' and os.path.exists(trace_sim[:-4] + '.timings.stats'):
+        content = []
+        with open(trace_sim[:-4] + '.timings.stats') as f:
+            content = f.readlines()
+
+        for line in content:
+            if line.split():
+                if line.split()[0] == 'Maximum':
+                    trace_data['useful_dim'] = float(line.split()[1])
+    else:
+        trace_data['useful_dim'] = 'NaN'
+
+    #Get runtime for simulated trace
+    if not trace_sim == '' and os.path.exists(trace_sim[:-4] + '.runtime.stats'):
+        content = []
+        with open(trace_sim[:-4] + '.runtime.stats') as f:
+            content = f.readlines()
+
+        for line in content:
+            if line.split():
+                if line.split()[0] == 'Average':
+                    trace_data['runtime_dim'] = float(line.split()[1])
+    else:
+        trace_data['runtime_dim'] = 'NaN'
+
+    #Remove paramedir output files
+    save_remove(trace_base + '.timings.stats')
+    save_remove(trace_base + '.runtime.stats')
+    save_remove(trace_base + '.cycles.stats')
+    save_remove(trace_base + '.instructions.stats')
+    if not trace_sim == '':
         save_remove(trace_sim[:-4] + '.timings.stats')
         save_remove(trace_sim[:-4] + '.runtime.stats')
-        time_prs = time.time() - time_prs
+    time_prs = time.time() - time_prs
 
-        time_tot = time.time() - time_tot
-        print('Finished successfully in {0:.1f} seconds.'.format(time_tot))
-        print('')
+    #Use the results of the native reader or check them against paramedir
+    if cmdl_args.reader == 'native':
+        trace_data.update(native_data)
+    elif cmdl_args.reader == 'check':
+        check_native_data(native_data, trace_data)
 
-    return raw_data
+    if dim_data:
+        trace_data.update(dim_data)
+    elif dim_entry:
+        write_cache(dim_entry, trace, dict((key, trace_data[key]) for key in dimemas_raw_data))
+
+    time_tot = time.time() - time_tot
+    print('Finished successfully in {0:.1f} seconds.'.format(time_tot))
+    print('')
+
+    return trace_data
 
 
 def get_scaling_type(raw_data, trace_list, trace_processes, cmdl_args):
@@ -618,6 +1776,14 @@ def get_scaling_type(raw_data, trace_list, trace_processes, cmdl_args):
     if len(trace_list) == 1:
         return 'strong'
 
+    #Without useful instructions of the smallest trace, the ratio is undefined
+    if not float(raw_data['useful_ins'][trace_list[0]]) > 0:
+        if not cmdl_args.scaling == 'auto':
+            return cmdl_args.scaling
+        print('==Warning== Could not detect the scaling type without useful instructions. Assuming strong scaling.')
+        print('')
+        return 'strong'
+
     for trace in trace_list:
         inst_ratio = float(raw_data['useful_ins'][trace]) / float(raw_data['useful_ins'][trace_list[0]])
         proc_ratio = float(trace_processes[trace]) / float(trace_processes[trace_list[0]])
@@ -655,12 +1821,14 @@ def get_scaling_type(raw_data, trace_list, trace_processes, cmdl_args):
     sys.exit(1)
 
 
-def compute_model_factors(raw_data, trace_list, trace_processes, cmdl_args):
+def compute_model_factors(raw_data, trace_list, trace_processes, cmdl_args, scaling=None):
     """Computes the model factors from the gathered raw data and returns the
-    according dictionary of model factors."""
+    according dictionary of model factors. The scaling type is guessed, see
+    get_scaling_type, unless it is given."""
     mod_factors = create_mod_factors(trace_list)
     #Guess the weak or strong scaling
-    scaling = get_scaling_type(raw_data, trace_list, trace_processes, cmdl_args)
+    if scaling is None:
+        scaling = get_scaling_type(raw_data, trace_list, trace_processes, cmdl_args)
 
     #Loop over all traces
     for trace in trace_list:
@@ -740,21 +1908,846 @@ def compute_model_factors(raw_data, trace_list, trace_processes, cmdl_args):
     return mod_factors
 
 
+#Event types of the MPI calls that define the runtime, see cfgs/runtime.cfg
+mpi_event_types = set(['50000001', '50000002', '50000003', '50000004', '50000005'])
+
+#State value of the useful (Running) state, see cfgs/timings.cfg
+useful_state = '1'
+
+#Event types of the hardware counters that are summed over the useful states,
+#see cfgs/cycles.cfg and cfgs/instructions.cfg
+counter_event_types = OrderedDict([('useful_cyc', '42000059'), ('useful_ins', '42000050')])
+
+
+def split_prv_fields(text):
+    """Splits text at the colons that are not enclosed in parentheses."""
+    fields = []
+    depth = 0
+    start = 0
+    for index, char in enumerate(text):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ':' and depth == 0:
+            fields.append(text[start:index])
+            start = index + 1
+    fields.append(text[start:])
+    return fields
+
+
+def parse_prv_header(line):
+    """Parses the header line of a Paraver trace, e.g.
+    #Paraver (01/02/2018 at 10:00):123456_ns:1(4):1:4(1:1,1:1,1:1,1:1),2
+    Returns a dictionary with the trace duration, the factor to convert trace
+    times to microseconds, the number of nodes and cpus, the number of threads
+    of each task per application, and the list of threads, where each thread is
+    identified by the string 'appl:task:thread'.
+    """
+    match = re.match(r'^#Paraver \((.*?)\):(\d+)(_ns|_us)?:(.*)$', line.rstrip())
+    if not match:
+        raise ValueError('invalid Paraver header: ' + line.rstrip()[:80])
+
+    header = {}
+    header['duration'] = int(match.group(2))
+    #Traces without unit are written in microseconds
+    header['to_us'] = 1000.0 if match.group(3) == '_ns' else 1.0
+
+    fields = split_prv_fields(match.group(4))
+    nodes = re.match(r'^(\d+)(?:\((.*)\))?$', fields[0])
+    header['nodes'] = int(nodes.group(1))
+    header['cpus'] = sum(int(cpus) for cpus in nodes.group(2).split(',')) if nodes.group(2) else 0
+
+    header['threads'] = []
+    header['tasks'] = 0
+    header['appls'] = []
+    for appl in range(int(fields[1])):
+        tasks = re.match(r'^(\d+)\((.*?)\)', fields[2 + appl])
+        header['tasks'] += int(tasks.group(1))
+        header['appls'].append([])
+        for task, threads in enumerate(tasks.group(2).split(',')):
+            header['appls'][-1].append(int(threads.split(':')[0]))
+            for thread in range(int(threads.split(':')[0])):
+                header['threads'].append(':'.join([str(appl + 1), str(task + 1), str(thread + 1)]))
+
+    return header
+
+
+def read_trace_native(trace, jobs=1, use_index=True):
+    """Reads a Paraver trace in a single pass with constant memory and computes
+    the raw data that paramedir computes with timings.cfg, runtime.cfg,
+    cycles.cfg, and instructions.cfg, see read_trace_lines. Decodes the trace
+    in large blocks with NumPy if available, using jobs processes, and falls
+    back to reading it line by line otherwise.
+    With use_index, the per-thread results are loaded from the index next to
+    the trace if it is up to date, and stored in it otherwise, see
+    read_trace_index.
+    """
+    if not import_numpy():
+        return native_raw_data(*read_trace_lines(trace))
+
+    if use_index:
+        result = read_trace_index(trace)
+        if result:
+            return native_raw_data(*result)
+
+    try:
+        result = read_trace_blocks(trace, jobs)
+    except (ValueError, IndexError) as error:
+        print('==Warning== Could not decode ' + trace + ' in blocks (' + str(error) + '). Reading it line by line.')
+        result = read_trace_lines(trace)
+
+    if use_index:
+        write_trace_index(trace, *result)
+    return native_raw_data(*result)
+
+
+#Version of the index format, see read_trace_index
+index_version = 1
+
+
+def get_index_name(trace):
+    """Returns the file name of the index of the given trace."""
+    return trace + '.idx.npz'
+
+
+def read_trace_index(trace):
+    """Loads the per-thread results of the native reader from the index of
+    the trace, e.g. trace.prv.idx.npz. The index holds the trace header, the
+    useful time and the time outside of the runtime window of each thread,
+    and the counter sums, together with the size and modification time of the
+    trace. Returns None if there is no index or if the trace has changed since
+    the index was written. Otherwise, returns the arguments for native_raw_data.
+    """
+    index = get_index_name(trace)
+    if not os.path.exists(index):
+        return None
+
+    stat = os.stat(trace)
+    try:
+        with numpy.load(index, allow_pickle=False) as content:
+            if not int(content['version']) == index_version or \
+               not int(content['size']) == stat.st_size or \
+               not int(content['mtime']) == stat.st_mtime_ns:
+                return None
+            header = parse_prv_header(str(content['header']))
+            threads = [str(thread) for thread in content['threads']]
+            useful = dict(zip(threads, content['useful'].tolist()))
+            mpi_outside = dict(zip(threads, content['mpi_outside'].tolist()))
+            counters = dict((key, int(content[key])) for key in counter_event_types)
+    except (IOError, OSError, KeyError, ValueError) as error:
+        print('==Warning== Ignoring unreadable index ' + index + ' (' + str(error) + ').')
+        return None
+
+    #Drop the threads without useful time or time outside of the window
+    useful = dict((thread, value) for thread, value in useful.items() if value)
+    mpi_outside = dict((thread, value) for thread, value in mpi_outside.items() if value)
+    if cmdl_args.debug:
+        print('==DEBUG== Loaded index ' + index)
+    return header, useful, mpi_outside, counters
+
+
+def write_trace_index(trace, header, useful, mpi_outside, counters):
+    """Writes the per-thread results of the native reader to the index of the
+    trace, see read_trace_index. The index is written to a temporary file and
+    renamed, so concurrent readers never see a partial index. Failures only
+    print a warning, e.g. for traces in read-only directories."""
+    index = get_index_name(trace)
+    with open_trace(trace, 'rt') as f:
+        header_line = f.readline().rstrip()
+    stat = os.stat(trace)
+
+    threads = sorted(set(useful) | set(mpi_outside))
+    content = {}
+    content['version'] = numpy.int64(index_version)
+    content['size'] = numpy.int64(stat.st_size)
+    content['mtime'] = numpy.int64(stat.st_mtime_ns)
+    content['header'] = numpy.array(header_line)
+    content['threads'] = numpy.array(threads, dtype=str)
+    content['useful'] = numpy.array([useful.get(thread, 0) for thread in threads], dtype=numpy.int64)
+    content['mpi_outside'] = numpy.array([mpi_outside.get(thread, 0) for thread in threads], dtype=numpy.int64)
+    for key in counter_event_types:
+        content[key] = numpy.int64(counters[key])
+
+    temporary = index + '.' + str(os.getpid()) + '.tmp'
+    try:
+        with open(temporary, 'wb') as f:
+            numpy.savez(f, **content)
+        os.replace(temporary, index)
+    except (IOError, OSError) as error:
+        print('==Warning== Could not write index ' + index + ' (' + str(error) + ').')
+        save_remove(temporary)
+
+
+def read_trace_lines(trace):
+    """Reads a Paraver trace line by line for the raw data that paramedir
+    computes with timings.cfg, runtime.cfg, cycles.cfg, and
+    instructions.cfg:
+    useful_tot, useful_avg, and useful_max are the total, average, and maximum
+    time per thread in the Running state, where the average only counts threads
+    that have been running. runtime is the average time per thread for which
+    the last MPI call event (types 50000001-50000005) has a value in [0,200),
+    i.e. the trace duration unless an MPI call has an unknown value.
+    All times are converted to microseconds by native_raw_data.
+    useful_cyc and useful_ins are the sums of the next counter event value
+    over the Running states: a Running state from begin to end counts every
+    counter event after begin up to and including the first one at or after
+    end. A Running state without such a final event only counts the events
+    within the state.
+    Returns the header, the useful time and the time outside of the runtime
+    window per thread, and the counter sums, as expected by native_raw_data.
+    """
+    useful = dict()
+    mpi_time = dict()
+    mpi_value = dict()
+    mpi_outside = dict()
+    counters = dict((key, 0) for key in counter_event_types)
+    counter_keys = dict((event_type, key) for key, event_type in counter_event_types.items())
+    #Running states per counter and thread that wait for their final event
+    open_states = dict((key, dict()) for key in counter_event_types)
+
+    with open_trace(trace, 'rt') as f:
+        header = parse_prv_header(f.readline())
+
+        for line in f:
+            #State record 1:cpu:appl:task:thread:begin:end:state
+            if line[0] == '1':
+                if line.endswith(':' + useful_state + '\n'):
+                    fields = line.split(':')
+                    thread = ':'.join(fields[2:5])
+                    begin = int(fields[5])
+                    end = int(fields[6])
+                    useful[thread] = useful.get(thread, 0) + end - begin
+                    if end > begin:
+                        for key in counter_event_types:
+                            open_states[key].setdefault(thread, []).append((begin, end))
+
+            #Event record 2:cpu:appl:task:thread:time:type:value[:type:value]
+            elif line[0] == '2':
+                if ':5000000' in line or ':4200005' in line:
+                    fields = line.rstrip().split(':')
+                    thread = ':'.join(fields[2:5])
+                    time_event = int(fields[5])
+                    for index in range(6, len(fields) - 1, 2):
+                        if fields[index] in mpi_event_types:
+                            if mpi_value.get(thread, 0) >= 200:
+                                mpi_outside[thread] = mpi_outside.get(thread, 0) + time_event - mpi_time[thread]
+                            mpi_time[thread] = time_event
+                            mpi_value[thread] = int(fields[index + 1])
+                        elif fields[index] in counter_keys:
+                            key = counter_keys[fields[index]]
+                            states = open_states[key].get(thread)
+                            if states:
+                                value = int(fields[index + 1])
+                                for begin, end in states:
+                                    if time_event > begin:
+                                        counters[key] += value
+                                open_states[key][thread] = [state for state in states if state[1] > time_event]
+
+    for thread in mpi_value:
+        if mpi_value[thread] >= 200:
+            mpi_outside[thread] = mpi_outside.get(thread, 0) + header['duration'] - mpi_time[thread]
+
+    return header, useful, mpi_outside, counters
+
+
+def read_trace_blocks(trace, jobs=1, block_size=16 * 1024 * 1024):
+    """Reads a Paraver trace in blocks of block_size bytes. Each block is
+    decoded into columns with NumPy and reduced to a partial result, see
+    reduce_prv_block, and the partial results are merged in trace order.
+    With jobs > 1, the trace body is split into byte ranges that are reduced
+    by a pool of jobs processes. Compressed traces are decompressed on the fly;
+    gzip traces with several members are decompressed in parallel, see
+    reduce_gzip_parallel. Returns the same results as read_trace_lines.
+    """
+    with open_trace(trace) as f:
+        header = parse_prv_header(f.readline().decode())
+        body_start = f.tell()
+    lookup = prv_thread_lookup(header)
+
+    #Daemonic processes, i.e. workers of the trace pool, cannot have children
+    if multiprocessing.current_process().daemon:
+        jobs = 1
+
+    if get_compression(trace):
+        partial = None
+        if jobs > 1 and get_compression(trace) is gzip:
+            partial = reduce_gzip_parallel(trace, jobs, lookup, block_size)
+        if partial is None:
+            with open_trace(trace) as f:
+                f.readline()
+                partial = reduce_prv_lines(f, lookup, block_size)
+        return (header,) + finish_prv_partial(header, partial)
+
+    body_size = os.path.getsize(trace) - body_start
+    if body_size < 4 * block_size:
+        jobs = 1
+
+    #Use more ranges than jobs to balance ranges with different record types
+    ranges = 1 if jobs == 1 else 4 * jobs
+    bounds = [body_start + body_size * index // ranges for index in range(ranges + 1)]
+    tasks = [(trace, bounds[index], bounds[index + 1], lookup, block_size) for index in range(ranges)]
+
+    partial = empty_prv_partial(lookup[2])
+    for range_partial in map_prv_tasks(reduce_prv_range, tasks, jobs):
+        partial = merge_prv_partials(partial, range_partial)
+
+    return (header,) + finish_prv_partial(header, partial)
+
+
+def map_prv_tasks(function, tasks, jobs):
+    """Yields the results of function for all tasks in order, computed by a
+    pool of jobs processes if jobs > 1."""
+    if jobs == 1:
+        for task in tasks:
+            yield function(task)
+        return
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for result in pool.imap(function, tasks):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def reduce_prv_range(task):
+    """Reduces the records of a trace that start in the byte range [start, end)
+    to a partial result. The line that crosses end is completed, the line that
+    crosses start is left to the previous range."""
+    trace, start, end, lookup, block_size = task
+    import_numpy()
+
+    with open(trace, 'rb') as f:
+        f.seek(start - 1)
+        if not f.read(1) == b'\n':
+            f.readline()
+        return reduce_prv_lines(f, lookup, block_size, end)
+
+
+def reduce_prv_lines(f, lookup, block_size, end=None):
+    """Reduces the records of the open trace f from the current position up to
+    the line that crosses the position end, or up to the end of the file, to a
+    partial result. The records are read in blocks of complete lines."""
+    partial = empty_prv_partial(lookup[2])
+    position = f.tell()
+
+    rest = b''
+    while end is None or position < end:
+        block = f.read(block_size if end is None else min(block_size, end - position))
+        if not block:
+            break
+        position += len(block)
+        if end is not None and position >= end and not block.endswith(b'\n'):
+            block += f.readline()
+        #Only decode complete lines, keep the rest for the next block
+        split = block.rfind(b'\n') + 1
+        if split == 0:
+            rest += block
+            continue
+        partial = merge_prv_partials(partial, reduce_prv_block(rest + block[:split], lookup))
+        rest = block[split:]
+
+    if rest.strip():
+        partial = merge_prv_partials(partial, reduce_prv_block(rest + b'\n', lookup))
+
+    return partial
+
+
+def find_gzip_members(trace, parts):
+    """Returns the offsets of gzip members that split the compressed trace into
+    up to parts parts of about equal size, starting with 0. Other offsets than
+    0 are only candidates, i.e. valid gzip headers that start a deflate stream,
+    and are verified while decompressing, see reduce_gzip_members."""
+    size = os.path.getsize(trace)
+    offsets = [0]
+    with open(trace, 'rb') as f:
+        for part in range(1, parts):
+            target = max(size * part // parts, offsets[-1] + 1)
+            f.seek(target)
+            window = f.read(1024 * 1024)
+            candidate = window.find(b'\x1f\x8b\x08')
+            while candidate >= 0:
+                #Reserved flags unset, known extra flags and operating system
+                header = window[candidate:candidate + 10]
+                if len(header) == 10 and not header[3] & 0xe0 and header[8] in (0, 2, 4) and \
+                   (header[9] <= 13 or header[9] == 255):
+                    try:
+                        zlib.decompressobj(31).decompress(window[candidate:candidate + 65536], 65536)
+                        offsets.append(target + candidate)
+                        break
+                    except zlib.error:
+                        pass
+                candidate = window.find(b'\x1f\x8b\x08', candidate + 1)
+    return offsets
+
+
+def reduce_gzip_parallel(trace, jobs, lookup, block_size):
+    """Decompresses and reduces a gzip trace with several members, e.g. written
+    by bgzip, in parts of whole members with a pool of jobs processes, see
+    reduce_gzip_members. The lines that cross the parts are reduced when the
+    parts are merged. Returns the partial result of the trace, or None if the
+    trace cannot be split, e.g. because it has a single member."""
+    offsets = find_gzip_members(trace, 4 * jobs)
+    if len(offsets) < 2:
+        return None
+
+    bounds = offsets + [os.path.getsize(trace)]
+    tasks = [(trace, bounds[index], bounds[index + 1], lookup, block_size) for index in range(len(offsets))]
+
+    partial = empty_prv_partial(lookup[2])
+    #The bytes of the line that crosses into the next part, None in the header
+    carry = None
+    try:
+        for index, (first, part_partial, rest, stop) in enumerate(map_prv_tasks(reduce_gzip_members, tasks, jobs)):
+            if not stop == bounds[index + 1]:
+                raise ValueError('gzip member at offset ' + str(bounds[index + 1]) + ' is not valid')
+            if first is None:
+                if carry is not None:
+                    carry += rest
+                continue
+            if carry is not None and (carry + first).strip():
+                partial = merge_prv_partials(partial, reduce_prv_block(carry + first + b'\n', lookup))
+            partial = merge_prv_partials(partial, part_partial)
+            carry = rest
+    except (ValueError, zlib.error) as error:
+        print('==Warning== Could not decompress ' + trace + ' in parallel (' + str(error) + '). Decompressing it serially.')
+        return None
+
+    if carry and carry.strip():
+        partial = merge_prv_partials(partial, reduce_prv_block(carry + b'\n', lookup))
+    return partial
+
+
+def reduce_gzip_members(task):
+    """Decompresses the gzip members that start in the byte range [start, end)
+    of a compressed trace and reduces the complete lines to a partial result.
+    Returns the bytes before the first newline, or None if there is none, the
+    partial result, the bytes after the last newline, and the offset of the
+    first member after the range, which must be end."""
+    trace, start, end, lookup, block_size = task
+    import_numpy()
+    partial = empty_prv_partial(lookup[2])
+    first = None
+    rest = b''
+
+    with open(trace, 'rb') as f:
+        f.seek(start)
+        offset = start
+        compressed = b''
+        decompressor = zlib.decompressobj(31)
+        member_end = True
+        while not (member_end and offset >= end):
+            if not compressed:
+                compressed = f.read(1024 * 1024)
+                if not compressed:
+                    break
+            data = decompressor.decompress(compressed, block_size)
+            member_end = decompressor.eof
+            if member_end:
+                compressed = decompressor.unused_data
+                decompressor = zlib.decompressobj(31)
+            else:
+                compressed = decompressor.unconsumed_tail
+            offset = f.tell() - len(compressed)
+
+            rest += data
+            if first is None:
+                split = rest.find(b'\n')
+                if split < 0:
+                    continue
+                first = rest[:split]
+                rest = rest[split + 1:]
+            if len(rest) >= block_size:
+                #Only decode complete lines, keep the rest for the next block
+                split = rest.rfind(b'\n') + 1
+                if split:
+                    partial = merge_prv_partials(partial, reduce_prv_block(rest[:split], lookup))
+                    rest = rest[split:]
+
+    if not member_end:
+        raise ValueError('truncated gzip member before offset ' + str(offset))
+    split = rest.rfind(b'\n') + 1
+    if first is not None and split:
+        partial = merge_prv_partials(partial, reduce_prv_block(rest[:split], lookup))
+        rest = rest[split:]
+    return first, partial, rest, offset
+
+
+def prv_thread_lookup(header):
+    """Returns the arrays to map the (appl, task, thread) of a record to the
+    index of the thread in header['threads']: the first task index of each
+    application and the first thread index of each task. The third element is
+    the total number of threads."""
+    appl_base = numpy.zeros(len(header['appls']), dtype=numpy.int64)
+    task_threads = []
+    for index, tasks in enumerate(header['appls']):
+        appl_base[index] = len(task_threads)
+        task_threads.extend(tasks)
+    task_base = numpy.zeros(len(task_threads), dtype=numpy.int64)
+    task_base[1:] = numpy.cumsum(task_threads)[:-1]
+    return appl_base, task_base, sum(task_threads)
+
+
+def empty_prv_partial(threads):
+    """Returns the partial result of an empty part of a trace with the given
+    number of threads. The partial result holds per thread:
+    useful:      time in the Running state
+    mpi_first_*: time and value of the first MPI call event, -1 if none
+    mpi_last_*:  time and value of the last MPI call event, -1 if none
+    mpi_outside: time between the events where the MPI call value is >= 200
+    running_first: begin of the first Running state with a duration, -1 if none
+    and for each counter, see read_trace_lines:
+    <counter>_total:    sum of the counted events of the closed Running states
+    <counter>_open:     thread, begin, and end of the Running states that wait
+                        for their final event
+    <counter>_head:     thread, time, and value of the events up to the first
+                        event at or after running_first, grouped by thread
+    <counter>_complete: whether the head contains the event at or after
+                        running_first
+    """
+    partial = {}
+    partial['useful'] = numpy.zeros(threads, dtype=numpy.int64)
+    partial['mpi_outside'] = numpy.zeros(threads, dtype=numpy.int64)
+    for key in ['mpi_first_t', 'mpi_first_v', 'mpi_last_t', 'mpi_last_v', 'running_first']:
+        partial[key] = numpy.full(threads, -1, dtype=numpy.int64)
+    empty = numpy.zeros(0, dtype=numpy.int64)
+    for key in counter_event_types:
+        partial[key + '_total'] = 0
+        partial[key + '_open'] = (empty, empty, empty)
+        partial[key + '_head'] = (empty, empty, empty)
+        partial[key + '_complete'] = numpy.zeros(threads, dtype=bool)
+    return partial
+
+
+def decode_prv_block(block):
+    """Decodes a block of complete trace lines into a flat array with all
+    numbers of all records, the offset of each record in this array, and the
+    number of fields of each record. Comment and communicator lines are
+    skipped. Raises ValueError if the block contains malformed records.
+    """
+    data = numpy.frombuffer(block, dtype=numpy.uint8)
+    newlines = numpy.flatnonzero(data == ord('\n'))
+    starts = numpy.concatenate(([0], newlines[:-1] + 1))
+
+    #Keep only lines that start with a digit, i.e. records
+    first = data[starts]
+    records = (first >= ord('0')) & (first <= ord('9'))
+    if not records.all():
+        data = data[numpy.repeat(records, newlines - starts + 1)]
+        newlines = numpy.flatnonzero(data == ord('\n'))
+        starts = numpy.concatenate(([0], newlines[:-1] + 1))
+    if not data.size:
+        empty = numpy.zeros(0, dtype=numpy.int64)
+        return empty, empty, empty
+
+    colons = numpy.searchsorted(numpy.flatnonzero(data == ord(':')), newlines)
+    fields = numpy.diff(colons, prepend=0) + 1
+
+    #Parse all numbers at once with colons as the only separator
+    text = data.copy()
+    text[newlines] = ord(':')
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        try:
+            values = numpy.fromstring(text[:-1].tobytes(), dtype=numpy.int64, sep=':')
+        except DeprecationWarning:
+            raise ValueError('malformed record')
+    if not values.size == fields.sum():
+        raise ValueError('malformed record')
+
+    offsets = numpy.cumsum(fields) - fields
+    return values, offsets, fields
+
+
+def reduce_prv_block(block, lookup):
+    """Decodes a block of complete trace lines and reduces the state, MPI call
+    event, and counter event records to a partial result, see
+    empty_prv_partial."""
+    appl_base, task_base, threads = lookup
+    partial = empty_prv_partial(threads)
+    values, offsets, fields = decode_prv_block(block)
+
+    def thread_index(record_offsets):
+        appl = values[record_offsets + 2] - 1
+        task = values[record_offsets + 3] - 1
+        thread = values[record_offsets + 4] - 1
+        return task_base[appl_base[appl] + task] + thread
+
+    kind = values[offsets]
+
+    #State records 1:cpu:appl:task:thread:begin:end:state
+    states = offsets[kind == 1]
+    states = states[values[states + 7] == int(useful_state)]
+    numpy.add.at(partial['useful'], thread_index(states), values[states + 6] - values[states + 5])
+
+    #Running states with a duration in trace order, i.e. ordered by begin
+    states = states[values[states + 6] > values[states + 5]]
+    state_thread = thread_index(states)
+    state_begin = values[states + 5]
+    state_end = values[states + 6]
+    running, first = numpy.unique(state_thread, return_index=True)
+    partial['running_first'][running] = state_begin[first]
+
+    #Event records 2:cpu:appl:task:thread:time:type:value[:type:value]
+    #Expand all type/value pairs in file order
+    events = kind == 2
+    pairs = (fields[events] - 6) // 2
+    events = offsets[events]
+    line = numpy.repeat(numpy.arange(events.size), pairs)
+    pair = numpy.arange(line.size) - numpy.repeat(numpy.cumsum(pairs) - pairs, pairs)
+    position = events[line] + 6 + 2 * pair
+
+    event_thread = thread_index(events)
+    for key, event_type in counter_event_types.items():
+        counter = values[position] == int(event_type)
+        thread = event_thread[line[counter]]
+        order = numpy.argsort(thread, kind='stable')
+        reduce_prv_counter(partial, key, thread[order], values[events + 5][line[counter]][order],
+                           values[position[counter] + 1][order], state_thread, state_begin, state_end)
+
+    mpi = (values[position] >= 50000001) & (values[position] <= 50000005)
+    line = line[mpi]
+    thread = event_thread[line]
+    event_time = values[events + 5][line]
+    event_value = values[position[mpi] + 1]
+
+    #Group the events by thread, keeping the trace order within each thread
+    order = numpy.argsort(thread, kind='stable')
+    thread = thread[order]
+    event_time = event_time[order]
+    event_value = event_value[order]
+    if thread.size:
+        boundaries = numpy.flatnonzero(thread[1:] != thread[:-1]) + 1
+        firsts = numpy.concatenate(([0], boundaries))
+        lasts = numpy.concatenate((boundaries - 1, [thread.size - 1]))
+        partial['mpi_first_t'][thread[firsts]] = event_time[firsts]
+        partial['mpi_first_v'][thread[firsts]] = event_value[firsts]
+        partial['mpi_last_t'][thread[lasts]] = event_time[lasts]
+        partial['mpi_last_v'][thread[lasts]] = event_value[lasts]
+
+        outside = (thread[1:] == thread[:-1]) & (event_value[:-1] >= 200)
+        numpy.add.at(partial['mpi_outside'], thread[:-1][outside], (event_time[1:] - event_time[:-1])[outside])
+
+    return partial
+
+
+def count_prv_events(thread, time, query_thread, query_time, inclusive=False):
+    """Returns for each query (thread, time) the number of events, ordered by
+    thread and time, before the query, i.e. the index where the query would be
+    inserted like numpy.searchsorted. With inclusive, the events at the time of
+    the query count as well."""
+    events = thread.size
+    tie = numpy.concatenate((numpy.ones(events, dtype=numpy.int8),
+                             numpy.full(query_thread.size, 2 if inclusive else 0, dtype=numpy.int8)))
+    order = numpy.lexsort((tie, numpy.concatenate((time, query_time)), numpy.concatenate((thread, query_thread))))
+    is_event = order < events
+    before = numpy.cumsum(is_event) - is_event
+    count = numpy.empty(query_thread.size, dtype=numpy.int64)
+    count[order[~is_event] - events] = before[~is_event]
+    return count
+
+
+def close_prv_states(events, states):
+    """Counts the events (thread, time, value), ordered by thread and time, for
+    the Running states (thread, begin, end). Returns the sum of the counted
+    events and a mask of the states that still wait for their final event."""
+    thread, time, value = events
+    state_thread, state_begin, state_end = states
+    cumulative = numpy.concatenate(([0], numpy.cumsum(value)))
+    thread_end = numpy.searchsorted(thread, state_thread, side='right')
+    low = count_prv_events(thread, time, state_thread, state_begin, inclusive=True)
+    final = count_prv_events(thread, time, state_thread, state_end)
+    closed = final < thread_end
+    total = (cumulative[numpy.where(closed, final + 1, thread_end)] - cumulative[low]).sum()
+    return int(total), ~closed
+
+
+def reduce_prv_counter(partial, key, thread, time, value, state_thread, state_begin, state_end):
+    """Reduces the events of one counter, ordered by thread, and the Running
+    states of a block to the partial result of the counter."""
+    total, waiting = close_prv_states((thread, time, value), (state_thread, state_begin, state_end))
+    partial[key + '_total'] = total
+    partial[key + '_open'] = (state_thread[waiting], state_begin[waiting], state_end[waiting])
+
+    #Keep the events up to the first one at or after the first Running state
+    first = partial['running_first']
+    running = numpy.flatnonzero(first >= 0)
+    limit = numpy.full(first.size, thread.size, dtype=numpy.int64)
+    limit[running] = count_prv_events(thread, time, running, first[running])
+    head = numpy.arange(thread.size) <= limit[thread]
+    partial[key + '_head'] = (thread[head], time[head], value[head])
+    partial[key + '_complete'][running] = limit[running] < numpy.searchsorted(thread, running, side='right')
+
+
+def merge_prv_counters(first, second, key, merged):
+    """Merges the partial results of one counter of two consecutive parts of a
+    trace: the open Running states of the first part count the head events of
+    the second part."""
+    #The values of the head events are carried along with the whole tuples below
+    head_thread, head_time = second[key + '_head'][:2]
+    total, waiting = close_prv_states(second[key + '_head'], first[key + '_open'])
+    merged[key + '_total'] = first[key + '_total'] + second[key + '_total'] + total
+    merged[key + '_open'] = tuple(numpy.concatenate((open_first[waiting], open_second))
+                                  for open_first, open_second in zip(first[key + '_open'], second[key + '_open']))
+
+    #Extend the head of the first part where it does not contain the first
+    #event at or after its first Running state yet
+    running_first = first['running_first']
+    incomplete = numpy.flatnonzero((running_first >= 0) & ~first[key + '_complete'])
+    limit = numpy.full(running_first.size, -1, dtype=numpy.int64)
+    limit[running_first < 0] = head_thread.size
+    limit[incomplete] = count_prv_events(head_thread, head_time, incomplete, running_first[incomplete])
+    extend = numpy.arange(head_thread.size) <= limit[head_thread]
+    head = [numpy.concatenate((head_first, head_second[extend]))
+            for head_first, head_second in zip(first[key + '_head'], second[key + '_head'])]
+    order = numpy.argsort(head[0], kind='stable')
+    merged[key + '_head'] = tuple(column[order] for column in head)
+
+    complete = numpy.where(running_first >= 0, first[key + '_complete'], second[key + '_complete'])
+    complete[incomplete] = limit[incomplete] < numpy.searchsorted(head_thread, incomplete, side='right')
+    merged[key + '_complete'] = complete
+
+
+def merge_prv_partials(first, second):
+    """Merges the partial results of two consecutive parts of a trace."""
+    merged = {}
+    merged['useful'] = first['useful'] + second['useful']
+    for key in counter_event_types:
+        merge_prv_counters(first, second, key, merged)
+    merged['running_first'] = numpy.where(first['running_first'] >= 0, first['running_first'], second['running_first'])
+
+    #Close the interval between the last event of the first part and the first
+    #event of the second part
+    gap = (first['mpi_last_t'] >= 0) & (second['mpi_first_t'] >= 0) & (first['mpi_last_v'] >= 200)
+    merged['mpi_outside'] = first['mpi_outside'] + second['mpi_outside'] + \
+                            numpy.where(gap, second['mpi_first_t'] - first['mpi_last_t'], 0)
+
+    has_first = first['mpi_first_t'] >= 0
+    has_last = second['mpi_last_t'] >= 0
+    for key in ['mpi_first_t', 'mpi_first_v']:
+        merged[key] = numpy.where(has_first, first[key], second[key])
+    for key in ['mpi_last_t', 'mpi_last_v']:
+        merged[key] = numpy.where(has_last, second[key], first[key])
+    return merged
+
+
+def finish_prv_partial(header, partial):
+    """Closes the partial result of a complete trace at the end of the trace.
+    Returns the dictionaries of the useful time and of the time outside of the
+    runtime window per thread, and the counter sums, as expected by
+    native_raw_data. Running states without final event only count the events
+    within the state, which are already part of the totals."""
+    outside = partial['mpi_outside'] + numpy.where((partial['mpi_last_t'] >= 0) & (partial['mpi_last_v'] >= 200),
+                                                   header['duration'] - partial['mpi_last_t'], 0)
+    useful = dict()
+    mpi_outside = dict()
+    for index, thread in enumerate(header['threads']):
+        if partial['useful'][index]:
+            useful[thread] = int(partial['useful'][index])
+        if outside[index]:
+            mpi_outside[thread] = int(outside[index])
+    counters = dict((key, partial[key + '_total']) for key in counter_event_types)
+    return useful, mpi_outside, counters
+
+
+def native_raw_data(header, useful, mpi_outside, counters):
+    """Computes the raw data of the native reader from the useful time and the
+    time outside of the runtime window of each thread, and the counter sums."""
+    to_us = header['to_us']
+    threads = set(header['threads']) | set(useful) | set(mpi_outside)
+    running = [useful[thread] for thread in useful if useful[thread] > 0]
+
+    data = {}
+    data['useful_tot'] = sum(running) / to_us
+    data['useful_max'] = max(running) / to_us if running else 0.0
+    data['useful_avg'] = sum(running) / len(running) / to_us if running else 0.0
+    if threads:
+        runtime = sum(header['duration'] - mpi_outside.get(thread, 0) for thread in threads)
+        data['runtime'] = runtime / len(threads) / to_us
+    else:
+        data['runtime'] = header['duration'] / to_us
+    data.update(counters)
+    return data
+
+
+def check_native_data(native_data, trace_data):
+    """Compares the raw data of the native reader with the paramedir results
+    and prints all values that differ by more than the paramedir precision."""
+    differences = 0
+    for key in native_data:
+        reference = trace_data[key]
+        value = native_data[key]
+        try: #except NaN
+            if abs(value - reference) <= 0.01 + 1e-6 * abs(reference):
+                continue
+        except TypeError:
+            if value == reference:
+                continue
+        print('==Warning== Native reader differs from paramedir for ' + raw_data_doc[key].strip() + ': ' + str(reference) + ' (paramedir) vs ' + str(value) + ' (native).')
+        differences += 1
+
+    if not differences:
+        print('Native reader matches paramedir.')
+
+
 def create_ideal_trace(trace, processes, cmdl_args):
-    """Runs prv2dim and dimemas with ideal configuration for given trace."""
-    trace_dim = trace[:-4] + '.dim'
-    trace_sim = trace[:-4] + '.sim.prv'
-    cmd = ['prv2dim', trace, trace_dim]
-    run_command(cmd)
+    """Runs prv2dim and dimemas with ideal configuration for given trace.
+    The Dimemas translation is passed from prv2dim to Dimemas as selected with
+    --dim-transfer: as .dim file next to the trace, as .dim file in the scratch
+    directory, or through a named pipe. If the named pipe fails, e.g. because
+    one of the tools needs to seek in the translation, the trace is translated
+    again into a .dim file next to the trace.
+    """
+    global dim_fifo_failed
 
-    if os.path.isfile(trace_dim):
+    trace_base = get_trace_base(trace)
+    trace_sim = trace_base + '.sim.prv'
+    trace_cfg = trace_base + '.dimemas_ideal.cfg'
+
+    #Remove an old simulation, so a failing Dimemas run is detected
+    save_remove(trace_sim)
+
+    #Create Dimemas configuration
+    with open(trace_cfg, 'w') as f:
+        f.write(render_dimemas_cfg(processes))
+
+    transfer = cmdl_args.dim_transfer
+    if transfer == 'fifo' and dim_fifo_failed:
+        transfer = 'file'
+
+    if transfer == 'fifo':
+        if not simulate_through_fifo(trace, trace_sim, trace_cfg, cmdl_args):
+            print('==Warning== Streaming the translation into Dimemas failed. Falling back to a .dim file.')
+            dim_fifo_failed = True
+            transfer = 'file'
+            save_remove(trace_sim)
+
+    if transfer == 'scratch':
+        scratch_dir = tempfile.mkdtemp(prefix='modelfactors_', dir=cmdl_args.scratch)
+        simulate_through_file(trace, os.path.join(scratch_dir, os.path.basename(trace_base) + '.dim'), trace_sim, trace_cfg, cmdl_args)
+        os.rmdir(scratch_dir)
+    elif transfer == 'file':
+        simulate_through_file(trace, trace_base + '.dim', trace_sim, trace_cfg, cmdl_args)
+
+    os.remove(trace_cfg)
+
+    if os.path.isfile(trace_sim):
         if cmdl_args.debug:
-            print('==DEBUG== Created file ' + trace_dim)
+            print('==DEBUG== Created file ' + trace_sim)
+        return trace_sim
     else:
-        print('==Error== ' + trace_dim + 'could not be creaeted.')
-        return
+        print('==Error== ' + trace_sim + ' could not be creaeted.')
+        return ''
 
-    #Create Dimemas configuration
+
+def render_dimemas_cfg(processes):
+    """Returns the ideal Dimemas configuration for the given number of
+    processes."""
     cfg_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'cfgs')
 
     content = []
@@ -763,32 +2756,693 @@ def create_ideal_trace(trace, processes, cmdl_args):
 
     content = [line.replace('REPLACE_BY_NTASKS', str(processes) ) for line in content]
     content = [line.replace('REPLACE_BY_COLLECTIVES_PATH', os.path.join(cfg_dir, 'dimemas.collectives')) for line in content]
+    return ''.join(content)
 
-    with open(trace[:-4]+'.dimemas_ideal.cfg', 'w') as f:
-        f.writelines(content)
 
-    cmd = ['Dimemas', '-S', '32k', '--dim', trace_dim, '-p', trace_sim, trace[:-4]+'.dimemas_ideal.cfg']
-    run_command(cmd)
+def release_fifo(fifo, flags):
+    """Opens and closes the named pipe fifo without blocking."""
+    try:
+        os.close(os.open(fifo, flags | os.O_NONBLOCK))
+    except OSError:
+        pass
 
-    os.remove(trace_dim)
-    os.remove(trace[:-4]+'.dimemas_ideal.cfg')
 
-    if os.path.isfile(trace_sim):
+#Set if the named pipe between prv2dim and Dimemas failed once in this process.
+dim_fifo_failed = False
+
+
+class TraceStream(object):
+    """Provides a plain Paraver trace to the external tools, which cannot read
+    compressed traces. For a compressed trace, the context yields a named pipe
+    in a private directory in the scratch directory, which a thread fills with
+    the decompressed trace, so the trace is never inflated on disk. The .pcf
+    and .row files of the trace are linked next to the named pipe. For a plain
+    trace, the context yields the trace itself.
+    The tool must read the trace once from start to end, see release_fifo.
+    """
+
+    def __init__(self, trace, cmdl_args):
+        self.trace = trace
+        self.cmdl_args = cmdl_args
+        self.directory = None
+        self.thread = None
+
+    def __enter__(self):
+        if not get_compression(self.trace):
+            return self.trace
+
+        base = get_trace_base(self.trace)
+        self.directory = tempfile.mkdtemp(prefix='modelfactors_', dir=self.cmdl_args.scratch)
+        fifo = os.path.join(self.directory, os.path.basename(base) + '.prv')
+        os.mkfifo(fifo)
+        for extension in ['.pcf', '.row']:
+            if os.path.exists(base + extension):
+                os.symlink(os.path.abspath(base + extension), os.path.join(self.directory, os.path.basename(base) + extension))
+
+        if self.cmdl_args.debug:
+            print('==DEBUG== Streaming decompressed trace through ' + fifo)
+
+        self.thread = threading.Thread(target=self.decompress, args=(fifo,))
+        self.thread.daemon = True
+        self.thread.start()
+        return fifo
+
+    def decompress(self, fifo):
+        try:
+            with open_trace(self.trace) as source:
+                with open(fifo, 'wb') as sink:
+                    shutil.copyfileobj(source, sink, 1024 * 1024)
+        except BrokenPipeError:
+            #The tool closed the pipe before the end of the trace
+            if self.cmdl_args.debug:
+                print('==DEBUG== Stopped streaming ' + self.trace)
+        except (IOError, OSError, EOFError, zlib.error, lzma.LZMAError) as error:
+            print('==ERROR== Failed to decompress ' + self.trace + ' (' + str(error) + ')')
+
+    def __exit__(self, *exception):
+        if not self.thread:
+            return False
+
+        #If the tool exited without opening the pipe, the thread blocks in open.
+        #Opening the read end releases it, so it fails on the next write.
+        fifo = os.path.join(self.directory, os.path.basename(get_trace_base(self.trace)) + '.prv')
+        while self.thread.is_alive():
+            release_fifo(fifo, os.O_RDONLY)
+            self.thread.join(0.5)
+
+        shutil.rmtree(self.directory, ignore_errors=True)
+        return False
+
+
+def simulate_through_file(trace, trace_dim, trace_sim, trace_cfg, cmdl_args):
+    """Translates the trace into the file trace_dim with prv2dim and simulates
+    it with Dimemas. The translation is removed afterwards."""
+    with TraceStream(trace, cmdl_args) as trace_plain:
+        cmd = ['prv2dim', trace_plain, trace_dim]
+        run_command(cmd, get_trace_size(trace))
+
+    if os.path.isfile(trace_dim):
         if cmdl_args.debug:
-            print('==DEBUG== Created file ' + trace_sim)
-        return trace_sim
+            print('==DEBUG== Created file ' + trace_dim)
     else:
-        print('==Error== ' + trace_sim + ' could not be creaeted.')
-        return ''
+        print('==Error== ' + trace_dim + ' could not be creaeted.')
+        return
+
+    cmd = ['Dimemas', '-S', '32k', '--dim', trace_dim, '-p', trace_sim, trace_cfg]
+    run_command(cmd, os.path.getsize(trace_dim))
 
+    os.remove(trace_dim)
 
-def compute_projection(mod_factors, trace_list, trace_processes, cmdl_args):
-    """Computes the projection from the gathered model factors and returns the
-    according dictionary of fitted prediction functions."""
+
+def simulate_through_fifo(trace, trace_sim, trace_cfg, cmdl_args):
+    """Runs prv2dim and Dimemas concurrently, connected through a named pipe,
+    so the translation is never written to disk. Both tools are admitted to the
+    memory budget together, as neither can finish without the other.
+    Returns True if both tools succeeded and the simulated trace exists.
+    """
+    fifo_dir = tempfile.mkdtemp(prefix='modelfactors_', dir=cmdl_args.scratch)
+    fifo = os.path.join(fifo_dir, os.path.basename(get_trace_base(trace)) + '.dim')
+    os.mkfifo(fifo)
+
+    size = get_trace_size(trace)
+    if memory_budget:
+        memory = memory_budget.estimate('prv2dim', size) + memory_budget.estimate('Dimemas', size)
+        memory_budget.acquire(memory)
 
     if cmdl_args.debug:
-        print('==DEBUG== Computing projection of model factors.')
+        print('==DEBUG== Streaming translation through ' + fifo)
+
+    return_values = {}
+
+    def translate():
+        with TraceStream(trace, cmdl_args) as trace_plain:
+            return_values['prv2dim'] = run_command(['prv2dim', trace_plain, fifo], size, admission=False)
+
+    def simulate():
+        return_values['Dimemas'] = run_command(['Dimemas', '-S', '32k', '--dim', fifo, '-p', trace_sim, trace_cfg], size, admission=False)
+
+    thread_prv2dim = threading.Thread(target=translate)
+    thread_dimemas = threading.Thread(target=simulate)
+    thread_prv2dim.start()
+    thread_dimemas.start()
+    try:
+        #If one tool exits without opening the pipe, the other one blocks in
+        #open. Opening the missing end releases it: prv2dim fails on the next
+        #write and Dimemas reads the end of the file.
+        while thread_prv2dim.is_alive() or thread_dimemas.is_alive():
+            if thread_prv2dim.is_alive() and not thread_dimemas.is_alive():
+                release_fifo(fifo, os.O_RDONLY)
+            if thread_dimemas.is_alive() and not thread_prv2dim.is_alive():
+                release_fifo(fifo, os.O_WRONLY)
+            thread_prv2dim.join(0.5)
+            thread_dimemas.join(0.5)
+    finally:
+        if memory_budget:
+            memory_budget.release(memory)
+        os.remove(fifo)
+        os.rmdir(fifo_dir)
+
+    return return_values.get('prv2dim') == 0 and return_values.get('Dimemas') == 0 and os.path.isfile(trace_sim)
+
+
+#Models of the projection, see get_projection_terms
+projection_models = ['amdahl', 'pipe', 'linear']
+
+#Projected metrics in the order of the rows of the fitted series
+projection_metrics = ['parallel_eff', 'load_balance', 'comm_eff', 'comp_scale', 'global_eff']
+
+#Number of points of the log-spaced grid of the projection table
+projection_grid_points = 200
+
+
+def get_projection_terms(model, x, f):
+    """Splits the projection model into x0 * a + c, as all models are linear in
+    x0, and returns a, c, and their derivatives by f for the given number of
+    processes x and parameter f."""
+    x, f = numpy.broadcast_arrays(x, f)
+    zeros = numpy.zeros(x.shape)
+    if model == 'amdahl':
+        #x0 / (f + (1 - f) * x)
+        a = 1 / (f + (1 - f) * x)
+        return a, -(1 - x) * a * a, zeros, zeros
+    elif model == 'pipe':
+        #x0 * x / ((1 - f) + f * (2 * x - 1))
+        denominator = (1 - f) + f * (2 * x - 1)
+        a = x / denominator
+        return a, -(2 * x - 2) * a / denominator, zeros, zeros
+    elif model == 'linear':
+        #x0 + f * x
+        return numpy.ones(x.shape), zeros, f * x, x
+    raise ValueError('unknown projection model ' + model)
+
+
+def fit_weighted_line(x, y, weights):
+    """Fits the line y = x0 + f * x to each row of y by weighted least squares,
+    i.e. minimizes sum((weights * (y - x0 - f * x))**2), in closed form.
+    Returns the arrays of x0 and f, which are NaN if x has less than two
+    distinct values with non-zero weight in a row."""
+    squares = weights * weights
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        total = squares.sum(axis=1)
+        mean_x = (squares * x).sum(axis=1) / total
+        mean_y = (squares * y).sum(axis=1) / total
+        f = (squares * (x - mean_x[:, None]) * (y - mean_y[:, None])).sum(axis=1) / \
+            (squares * (x - mean_x[:, None]) ** 2).sum(axis=1)
+    return mean_y - f * mean_x, f
+
+
+def fit_projection(model, x, y, sigma, bounds=(-float('inf'), float('inf')),
+                   tolerance=1e-12, max_iterations=500, start_points=3):
+    """Fits the projection model to many series at once by weighted least
+    squares, i.e. minimizes sum(((y - model(x, x0, f)) / sigma)**2) for each
+    series, and returns the optimal parameters and their covariance like
+    scipy.optimize.curve_fit.
+    y holds one series per row; x and sigma are broadcast against y, so the
+    series share the numbers of processes or each series has its own. Missing
+    values in y are NaN. bounds limits f; x0 is not bounded.
+    As the models are linear in x0, the optimal x0 for a given f is computed
+    in closed form (variable projection), and f is found by a vectorized
+    Levenberg-Marquardt iteration on all series with analytic derivatives,
+    starting from f = 1 and the start_points best local minima of a scan of f.
+    The linear model is solved in closed form, and the amdahl model starts from
+    the closed-form solution of its linearization instead, unless it violates
+    the bounds.
+    Returns an array of [x0, f] per series and the covariance matrices.
+    """
+    y = numpy.atleast_2d(numpy.asarray(y, dtype=float))
+    x = numpy.broadcast_to(numpy.asarray(x, dtype=float), y.shape)
+    valid = numpy.isfinite(y)
+    weights = numpy.where(valid, 1 / numpy.broadcast_to(numpy.asarray(sigma, dtype=float), y.shape), 0.0)
+    y = numpy.where(valid, y, 0.0)
+    lower, upper = bounds
+
+    def evaluate(rows, f):
+        """Returns the optimal x0, the weighted residuals, their derivative by
+        f, and the derivatives of the model by x0 and f for the given rows of
+        y and values of f."""
+        a, da, c, dc = get_projection_terms(model, x[rows], f[:, None])
+        with numpy.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            wa = weights[rows] * a
+            wda = weights[rows] * da
+            wb = weights[rows] * (y[rows] - c)
+            wdc = weights[rows] * dc
+            norm = (wa * wa).sum(axis=1)
+            x0 = (wa * wb).sum(axis=1) / norm
+            dx0 = ((wda * wb).sum(axis=1) - (wa * wdc).sum(axis=1) - 2 * x0 * (wa * wda).sum(axis=1)) / norm
+            residuals = wb - x0[:, None] * wa
+            jacobian = -wdc - x0[:, None] * wda - dx0[:, None] * wa
+            model_jacobian = numpy.stack([wa, x0[:, None] * wda + wdc], axis=2)
+            cost = numpy.nan_to_num((residuals * residuals).sum(axis=1), nan=numpy.inf)
+        return x0, cost, residuals, jacobian, model_jacobian
+
+    def iterate(rows, f):
+        """Runs the Levenberg-Marquardt iteration for the given rows of y from
+        the given values of f and returns x0, f, the cost, and the derivatives
+        of the model at the optimum."""
+        x0, cost, residuals, jacobian, model_jacobian = evaluate(rows, f)
+        damping = numpy.full(len(rows), 1e-3)
+        active = numpy.isfinite(cost)
+
+        for iteration in range(max_iterations):
+            if not active.any():
+                break
+            with numpy.errstate(divide='ignore', invalid='ignore', over='ignore'):
+                curvature = (jacobian * jacobian).sum(axis=1)
+                step = -(residuals * jacobian).sum(axis=1) / (curvature * (1 + damping))
+                trial = numpy.clip(numpy.where(active, f + step, f), lower, upper)
+            trial_x0, trial_cost, trial_residuals, trial_jacobian, trial_model_jacobian = evaluate(rows, trial)
+
+            better = active & (trial_cost <= cost)
+            converged = better & ((numpy.abs(trial - f) <= tolerance * (numpy.abs(f) + tolerance)) |
+                                  (cost - trial_cost <= tolerance * cost))
+            f = numpy.where(better, trial, f)
+            x0 = numpy.where(better, trial_x0, x0)
+            cost = numpy.where(better, trial_cost, cost)
+            residuals = numpy.where(better[:, None], trial_residuals, residuals)
+            jacobian = numpy.where(better[:, None], trial_jacobian, jacobian)
+            model_jacobian = numpy.where(better[:, None, None], trial_model_jacobian, model_jacobian)
+            damping = numpy.where(better, damping / 10, damping * 10)
+            active &= ~converged & (damping < 1e16)
+
+        return x0, f, cost, model_jacobian
+
+    series = len(y)
+    x0 = numpy.full(series, numpy.nan)
+    f = numpy.full(series, numpy.nan)
+    cost = numpy.full(series, numpy.inf)
+    model_jacobian = numpy.zeros(y.shape + (2,))
+
+    #Fast paths: the linear model is a weighted linear regression, and the
+    #amdahl model is one after taking 1 / y, see below. Series that cannot
+    #take them are left to the scan.
+    fast = numpy.zeros(series, dtype=bool)
+    check = numpy.ones(series, dtype=bool)
+    if model == 'linear':
+        #The cost is convex, so with bounds the optimum is at the nearest bound
+        #of f with the according optimal x0
+        closed_x0, closed_f = fit_weighted_line(x, y, weights)
+        fast = numpy.isfinite(closed_f)
+        rows = numpy.flatnonzero(fast)
+        f[rows] = numpy.clip(closed_f[rows], lower, upper)
+        result = evaluate(rows, f[rows])
+        x0[rows], cost[rows], model_jacobian[rows] = result[0], result[1], result[4]
+        check = ~fast
+    elif model == 'amdahl':
+        #1 / y = alpha + beta * x with alpha = f / x0 and beta = (1 - f) / x0.
+        #The weights follow from d(1 / y) = -dy / y**2, but the result still
+        #differs slightly from the least-squares fit of y, so it is polished
+        #by the iteration, which converges within a few steps from there.
+        #Solutions that violate the bounds are left to the scan.
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            alpha, beta = fit_weighted_line(x, numpy.where(valid, 1 / y, 0.0), weights * y * y)
+            closed_x0 = 1 / (alpha + beta)
+            closed_f = numpy.where(numpy.where(valid, y > 0, True).all(axis=1), alpha * closed_x0, numpy.nan)
+        fast = numpy.isfinite(closed_x0) & numpy.isfinite(closed_f) & (closed_f >= lower) & (closed_f <= upper)
+        rows = numpy.flatnonzero(fast)
+        x0[rows], f[rows], cost[rows], model_jacobian[rows] = iterate(rows, closed_f[rows])
+
+    #The cost may have narrow local minima close to the poles of the models,
+    #i.e. for f close to 0 or 1 at scale 1 / x. Scan f in [0, 1], the range of
+    #the efficiency models, with additional logarithmic steps towards 0 and 1
+    #from both sides. Series without fast path, or whose polished amdahl fit
+    #ended in a local minimum that is worse than a point of the scan, are
+    #iterated from the best local minima of the scan and from f = 1, the start
+    #value of curve_fit.
+    checked = numpy.flatnonzero(check)
+    if len(checked):
+        steps = numpy.logspace(-8, 3, 45)
+        scan = numpy.concatenate([numpy.linspace(0, 1, 17), steps, -steps, 1 - steps, 1 + steps])
+        scan = numpy.unique(numpy.clip(scan, lower, upper))
+        scan_cost = evaluate(numpy.repeat(checked, len(scan)), numpy.tile(scan, len(checked)))[1].reshape(len(checked), len(scan))
+        retry = ~fast[checked] | (scan_cost.min(axis=1) < cost[checked])
+        pending = checked[retry]
+        scan_cost = scan_cost[retry]
+    else:
+        pending = checked
+    if len(pending):
+        padded = numpy.pad(scan_cost, ((0, 0), (1, 1)), constant_values=numpy.inf)
+        minima = (scan_cost <= padded[:, :-2]) & (scan_cost <= padded[:, 2:])
+        ranking = numpy.argsort(numpy.where(minima, scan_cost, numpy.inf), axis=1, kind='stable')
+        starts = [numpy.full(len(pending), numpy.clip(1.0, lower, upper))]
+        starts += [scan[index] for index in ranking[:, :start_points].T]
+
+        result = iterate(numpy.tile(pending, len(starts)), numpy.concatenate(starts))
+
+        #Keep the best result of all starts of each series
+        best = numpy.argmin(result[2].reshape(len(starts), len(pending)), axis=0) * len(pending) + numpy.arange(len(pending))
+        x0[pending], f[pending], cost[pending], model_jacobian[pending] = [value[best] for value in result]
+
+    #Covariance as curve_fit: pseudo-inverse of J^T J scaled by the reduced chi-square
+    points = valid.sum(axis=1)
+    normal = numpy.einsum('sni,snj->sij', model_jacobian, model_jacobian)
+    singular = ~numpy.isfinite(normal).all(axis=(1, 2)) | (points <= 2)
+    normal[singular] = 0.0
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        covariance = numpy.linalg.pinv(normal) * (cost / (points - 2))[:, None, None]
+    covariance[singular | ~numpy.isfinite(covariance).all(axis=(1, 2))] = numpy.inf
+
+    return numpy.stack([x0, f], axis=1), covariance
+
+
+#Number of bootstrap resamples that are fitted per task
+bootstrap_chunk = 250
+
+
+def bootstrap_projection(task):
+    """Fits the projection model to bootstrap resamples of the measured series.
+    Each resample adds residuals, drawn with replacement from the scaled
+    residuals of the series, to the fitted values (residual bootstrap), as the
+    few measurements of a series are too few to resample the points
+    themselves. All resamples are fitted at once, see fit_projection.
+    Returns the array of [x0, f] per resample and series.
+    """
+    model, x_proc, fitted, residuals, sigma, bounds, resamples, seed = task
+    import_numpy()
+    random = numpy.random.default_rng(seed)
+    series, points = fitted.shape
+    picks = random.integers(0, points, size=(resamples, series, points))
+    y = fitted + sigma * numpy.take_along_axis(numpy.broadcast_to(residuals, picks.shape), picks, axis=2)
+    opt = fit_projection(model, x_proc, y.reshape(-1, points), sigma, bounds)[0]
+    return opt.reshape(resamples, series, 2)
+
+
+def compute_bootstrap_curves(model, x_proc, y, sigma, bounds, opt, x_grid, seed, cmdl_args):
+    """Bootstraps the projection of the series in the rows of y, see
+    bootstrap_projection, with opt, the parameters of the fits of y. The
+    --resamples resamples are fitted by -j/--jobs processes, with random
+    streams spawned from the SeedSequence seed.
+    Returns the projections of all resamples at the numbers of processes
+    x_grid as array of resample, row of y, and point of x_grid.
+    """
+    a, da, c, dc = get_projection_terms(model, x_proc, opt[:, 1:])
+    fitted = opt[:, :1] * a + c
+
+    #Standardize the residuals, remove their mean, and compensate for the two
+    #fitted parameters
+    points = len(x_proc)
+    residuals = (y - fitted) / sigma
+    residuals = (residuals - residuals.mean(axis=1, keepdims=True)) * numpy.sqrt(points / (points - 2))
+
+    seeds = seed.spawn((cmdl_args.resamples + bootstrap_chunk - 1) // bootstrap_chunk)
+    tasks = []
+    for index, seed in enumerate(seeds):
+        resamples = min(bootstrap_chunk, cmdl_args.resamples - index * bootstrap_chunk)
+        tasks.append((model, x_proc, fitted, residuals, sigma, bounds, resamples, seed))
+    params = numpy.concatenate(list(map_prv_tasks(bootstrap_projection, tasks, min(cmdl_args.jobs, len(tasks)))))
+
+    a, da, c, dc = get_projection_terms(model, x_grid, params[:, :, 1:])
+    return params[:, :, :1] * a + c
+
+
+def evaluate_projection(models, opt, x):
+    """Evaluates the projection of all metrics in projection_metrics with the
+    given models and parameters [x0, f] per metric at the numbers of processes
+    x, which may be a number or an array. Parallel and global efficiency are
+    the products of the fitted metrics, as in the gnuplot file.
+    Returns the array of the projected values per metric and point of x.
+    """
+    x = numpy.asarray(x, dtype=float)
+    opt = numpy.asarray(opt, dtype=float)
+    values = numpy.zeros((len(projection_metrics),) + x.shape)
+    for model in set(models):
+        rows = [row for row in range(len(models)) if models[row] == model]
+        params = opt[rows].reshape((len(rows), 2) + (1,) * x.ndim)
+        a, da, c, dc = get_projection_terms(model, x, params[:, 1])
+        values[rows] = params[:, 0] * a + c
+    values[0] = values[1] * values[2] / 100
+    values[4] = values[0] * values[3] / 100
+    return values
+
+
+def project_resources(models, opt, x, x_ref, runtime, scaling):
+    """Combines the projected global efficiency into the projected speedup,
+    runtime, and core hours at the numbers of processes x. The smallest run
+    with x_ref processes and the runtime in seconds is the reference. With
+    strong scaling the work is fixed, so
+    T(x) = T(x_ref) * x_ref * GE(x_ref) / (x * GE(x)); with weak scaling it
+    grows with x, so T(x) = T(x_ref) * GE(x_ref) / GE(x). The speedup is scaled
+    by the number of processes for weak scaling, as in compute_model_factors.
+    The projected global efficiency is clamped to at most 100%.
+    Returns the arrays of global efficiency, speedup, runtime, and core hours;
+    runtime and core hours are NaN if the runtime is None.
+    """
+    x = numpy.asarray(x, dtype=float)
+    global_eff = numpy.minimum(evaluate_projection(models, opt, x)[4], 100)
+    global_ref = min(evaluate_projection(models, opt, x_ref)[4], 100)
+    if runtime is None:
+        runtime = numpy.nan
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        speedup = x / x_ref * global_eff / global_ref
+        if scaling == 'strong':
+            runtime_x = runtime * x_ref * global_ref / (x * global_eff)
+        else:
+            runtime_x = runtime * global_ref / global_eff
+    #A non-positive efficiency means the run never finishes
+    runtime_x = numpy.where(global_eff > 0, runtime_x, numpy.inf)
+    core_hours = runtime_x * x / 3600
+    return global_eff, speedup, runtime_x, core_hours
+
+
+def recommend_processes(x, global_eff, speedup, core_hours, scaling, floor=None, budget=None):
+    """Returns the index of the recommended number of processes in x, or None
+    if no number of processes meets the constraints. The candidates keep the
+    projected global efficiency at or above floor, in percent, from the
+    smallest run on, and do not exceed budget core hours. The candidates also
+    end where the projection becomes implausible: the global efficiency must
+    be positive and rise neither with the number of processes nor above 100%,
+    and the speedup must not be superlinear. With strong scaling the candidate
+    with the largest speedup, i.e. the shortest runtime, is recommended, with
+    weak scaling the largest one, i.e. the largest problem.
+    """
+    implausible = ~(global_eff > 0) | (global_eff > 100)
+    implausible |= speedup > x / x[0] * (1 + 1e-9)
+    implausible[1:] |= global_eff[1:] > global_eff[:-1]
+
+    #Stop at the first implausible point or drop below the floor; a model can
+    #rise again far out
+    if floor is not None:
+        implausible |= ~(global_eff >= floor)
+    candidates = numpy.ones(len(x), dtype=bool)
+    stop = numpy.flatnonzero(implausible)
+    if stop.size:
+        candidates[stop[0]:] = False
+    if budget is not None:
+        candidates &= core_hours <= budget
+
+    indices = numpy.flatnonzero(candidates)
+    if not indices.size:
+        return None
+    if scaling == 'strong':
+        return indices[numpy.argmax(speedup[indices])]
+    return indices[-1]
+
+
+def get_recommendation(models, opt, x_min, limit, runtime, scaling, cmdl_args):
+    """Evaluates the projected resources at every number of processes from the
+    smallest run x_min up to limit, see project_resources, and selects the
+    recommendation for --efficiency-floor and --budget, see
+    recommend_processes. The budget requires the runtime. Returns the number
+    of processes and the projected global efficiency, speedup, runtime, and
+    core hours there, or None.
+    """
+    x = numpy.arange(numpy.ceil(x_min), max(limit, x_min) + 1)
+    global_eff, speedup, runtime_x, core_hours = project_resources(models, opt, x, x_min, runtime, scaling)
+
+    index = recommend_processes(x, global_eff, speedup, core_hours, scaling, cmdl_args.efficiency_floor, cmdl_args.budget)
+    if index is None:
+        return None
+    return int(x[index]), global_eff[index], speedup[index], runtime_x[index], core_hours[index]
+
+
+def print_recommendation(recommendation, cmdl_args):
+    """Prints the recommended number of processes and its projected metrics,
+    see get_recommendation, on stdout."""
+    constraints = []
+    if cmdl_args.efficiency_floor is not None:
+        constraints.append('global efficiency of at least {0:.2f}%'.format(cmdl_args.efficiency_floor))
+    if cmdl_args.budget is not None:
+        constraints.append('at most {0:g} core hours'.format(cmdl_args.budget))
+
+    if recommendation is None:
+        print('==Warning== No number of processes up to the limit meets the ' + ' and '.join(constraints) + '.')
+        print('')
+        return
+
+    processes, global_eff, speedup, runtime, core_hours = recommendation
+    print('Recommended number of processes for ' + ' and '.join(constraints) + ': ' + str(processes))
+    print('  Global efficiency'.ljust(22) + '{0:.2f}%'.format(global_eff))
+    print('  Speedup'.ljust(22) + '{0:.2f}'.format(speedup))
+    if numpy.isfinite(runtime):
+        print('  Runtime (s)'.ljust(22) + '{0:.4g}'.format(runtime))
+        print('  Core hours'.ljust(22) + '{0:.4g}'.format(core_hours))
+    print('')
+
+
+def get_projection_callables(models, opt):
+    """Returns the dictionary <metric><function of the number of processes>
+    of the projection with the given models and parameters per metric, see
+    evaluate_projection. The functions accept numbers and arrays."""
+    models = list(models)
+    opt = numpy.array(opt, dtype=float)
+    callables = OrderedDict()
+    for row, metric in enumerate(projection_metrics):
+        callables[metric] = lambda x, row=row: evaluate_projection(models, opt, x)[row]
+    return callables
+
+
+def load_projection(path='modelfactors.projection.npz'):
+    """Loads a projection written by write_projection_grid, e.g. to query
+    the projected efficiencies at any number of processes without fitting
+    again. Returns the dictionary <metric><function of the number of
+    processes>, see get_projection_callables."""
+    import_numpy()
+    with numpy.load(path, allow_pickle=False) as data:
+        return get_projection_callables([str(model) for model in data['models']], data['params'])
+
+
+def write_projection_grid(x_grid, values, models, opt, bands=None, resources=None):
+    """Writes the projection of all metrics at the numbers of processes x_grid,
+    the lower and upper confidence bands if given, and the projected speedup,
+    runtime, and core hours if given, see project_resources, to
+    modelfactors.projection.csv in the execution directory. The same table
+    and the models and parameters are stored in modelfactors.projection.npz,
+    which load_projection reads."""
+    metrics = [mod_factors_doc[metric].strip() for metric in projection_metrics]
+
+    file_path = os.path.join(os.getcwd(), 'modelfactors.projection.csv')
+    with open(file_path, 'w') as output:
+        line = 'Number of processes'
+        for metric in metrics:
+            line += ';' + metric
+            if bands:
+                line += ';' + metric + ' (lower);' + metric + ' (upper)'
+        if resources:
+            line += ';Speedup;Runtime (s);Core hours'
+        output.write(line + '\n')
+
+        for point in range(len(x_grid)):
+            line = '{0:.6f}'.format(x_grid[point])
+            for index in range(len(metrics)):
+                line += ';' + '{0:.6f}'.format(values[index, point])
+                if bands:
+                    line += ';' + '{0:.6f}'.format(bands[0][index, point]) + ';' + '{0:.6f}'.format(bands[1][index, point])
+            if resources:
+                for resource in resources:
+                    if numpy.isnan(resource[point]):
+                        line += ';NaN'
+                    else:
+                        line += ';' + '{0:.6f}'.format(resource[point])
+            output.write(line + '\n')
+
+    arrays = {'processes': x_grid, 'values': values, 'metrics': numpy.array(projection_metrics),
+              'models': numpy.array(models), 'params': opt}
+    if bands:
+        arrays['lower'], arrays['upper'] = bands
+    if resources:
+        arrays['speedup'], arrays['runtime'], arrays['core_hours'] = resources
+    numpy.savez(os.path.join(os.getcwd(), 'modelfactors.projection.npz'), **arrays)
+
+    print('Projection table written to ' + file_path)
+
+
+def get_projection_function(name, model, opt, x_min):
+    """Returns the gnuplot definition of the function name( x ) that projects
+    the metric with the given model and parameters [x0, f] for x > x_min."""
+    if model == 'amdahl':
+        return ' '.join([name + '( x ) = ( x >',str(x_min),') ?',str(opt[0]),'/ (',str(opt[1]),'+ ( 1 -',str(opt[1]),') * x ) : 1/0'])
+    elif model == 'pipe':
+        return ' '.join([name + '( x ) = ( x >',str(x_min),') ?',str(opt[0]),'* x / ( ( 1 -',str(opt[1]),') +',str(opt[1]),'* ( 2 * x - 1 ) ) : 1/0'])
+    elif model == 'linear':
+        return ' '.join([name + '( x ) = ( x >',str(x_min),') ?',str(opt[0]),'+ x *',str(opt[1]),': 1/0'])
+    raise ValueError('unknown projection model ' + model)
+
+
+def select_projection_models(x_proc, y, sigma, bounds):
+    """Selects the projection model for each series in the rows of y by
+    leave-one-out validation: every model is fitted to every series with one
+    run left out, and scored by the root mean square error of its prediction
+    of the left-out runs. The subsets are missing values of one batch per
+    model, see fit_projection.
+    The series are efficiencies, which cannot grow beyond 100%. A model whose
+    fit to the whole series rises above 100% and above the largest run far
+    beyond the measurements, e.g. linear with a positive slope, is excluded
+    and gets the score inf, unless all models are excluded.
+    Returns the list of the best models and the array of scores per model in
+    projection_models and series.
+    """
+    series, points = y.shape
+    held_out = numpy.eye(points, dtype=bool)
+    subsets = numpy.where(held_out, numpy.nan, y[:, None, :]).reshape(-1, points)
+    x_far = numpy.array([x_proc[-1], x_proc[-1] * 10000])
+
+    scores = numpy.zeros((len(projection_models), series))
+    unbounded = numpy.zeros((len(projection_models), series), dtype=bool)
+    for index, model in enumerate(projection_models):
+        opt = fit_projection(model, x_proc, subsets, sigma, bounds)[0]
+        a, da, c, dc = get_projection_terms(model, x_proc, opt[:, 1:])
+        prediction = (opt[:, :1] * a + c).reshape(series, points, points)
+        with numpy.errstate(invalid='ignore', over='ignore'):
+            error = numpy.diagonal(prediction, axis1=1, axis2=2) - y
+            scores[index] = numpy.sqrt((error * error).mean(axis=1))
+
+        opt = fit_projection(model, x_proc, y, sigma, bounds)[0]
+        a, da, c, dc = get_projection_terms(model, x_far, opt[:, 1:])
+        last, far = (opt[:, :1] * a + c).T
+        unbounded[index] = far > numpy.maximum(100, last)
+
+    #Keep all models for series where every model is unbounded
+    unbounded[:, unbounded.all(axis=0)] = False
+    scores[unbounded] = numpy.inf
+
+    best = numpy.argmin(numpy.nan_to_num(scores, nan=numpy.inf), axis=0)
+    return [projection_models[index] for index in best], scores
 
+
+def print_model_scores(models, scores):
+    """Prints the scores of the automatic model selection per metric, see
+    select_projection_models, and the selected model on stdout. Excluded
+    models are marked as unbounded. Parallel and global efficiency are
+    products of the fitted metrics, so their selection is marked as derived."""
+    metrics = projection_metrics
+
+    print('Leave-one-out error of the projection models:')
+
+    longest_name = max(len(mod_factors_doc[metric]) for metric in metrics)
+
+    line = ''.rjust(longest_name)
+    for model in projection_models:
+        line += ' | '
+        line += model.rjust(10)
+    line += ' | ' + 'selected'.rjust(10)
+    print(line)
+
+    print(''.ljust(len(line),'='))
+
+    for row, metric in enumerate(metrics):
+        line = mod_factors_doc[metric].ljust(longest_name)
+        for index in range(len(projection_models)):
+            line += ' | '
+            if numpy.isposinf(scores[index, row]):
+                line += 'unbounded'.rjust(10)
+            else:
+                line += ('{0:.2f}%'.format(scores[index, row])).rjust(10)
+        if metric in ['parallel_eff', 'global_eff']:
+            line += ' | ' + 'derived'.rjust(10)
+        else:
+            line += ' | ' + models[row].rjust(10)
+        print(line)
+    print('')
+
+
+def fit_mod_factors(mod_factors, trace_list, trace_processes, cmdl_args, report=True):
+    """Selects the projection model of each metric in projection_metrics, see
+    select_projection_models, and fits it to the model factors of the traces.
+    With report, warnings and the scores of --model auto are printed.
+    Returns the numbers of processes and the model factors as arrays, the data
+    uncertainty and bounds of the fit, and the list of models and the array of
+    parameters [x0, f] per metric.
+    """
     number_traces = len(trace_list)
     x_proc = numpy.zeros(number_traces)
     y_para = numpy.zeros(number_traces)
@@ -806,38 +3460,12 @@ def compute_projection(mod_factors, trace_list, trace_processes, cmdl_args):
         y_comp[index] = mod_factors['comp_scale'][trace]
         y_glob[index] = mod_factors['global_eff'][trace]
 
-    def amdahl(x, x0, f):
-        """#Projection function based on amdahl; 2 degrees of freedom: x0, f"""
-        return x0 / (f + (1 - f) * x)
-
-    def pipe(x, x0, f):
-        """Projection function based on pipeline; 2 degrees of freedom: x0, f"""
-        return x0 * x / ((1 - f) + f * (2 * x - 1) )
-
-    def linear(x, x0, f):
-        """Projection function linear; 2 degrees of freedom: x0, a"""
-        return x0 + f * x
-
-    #Select model function
-    if cmdl_args.model == 'amdahl':
-        model = amdahl
-    elif cmdl_args.model == 'pipe':
-        model = pipe
-    elif cmdl_args.model == 'linear':
-        model = linear
-
-    #Set limit for projection
-    if cmdl_args.limit:
-        limit = cmdl_args.limit
-    else:
-        limit = '10000'
-
-    #Set boundary for curve fitting parameters: ([x0_min,f_min],[x0_max,f_max])
+    #Set boundary for the curve fitting parameter f; x0 is not bounded
     #For amdahl and pipe f is in [0,1]
     if cmdl_args.bounds == 'yes':
-        bounds = ([-numpy.inf,0],[numpy.inf,1])
+        bounds = (0, 1)
     else:
-        bounds = ([-numpy.inf,-numpy.inf],[numpy.inf,numpy.inf])
+        bounds = (-numpy.inf, numpy.inf)
 
     #Set data uncertainty for vector with y-values.
     #Smaller values mean higher priority for these y-values.
@@ -850,53 +3478,93 @@ def compute_projection(mod_factors, trace_list, trace_processes, cmdl_args):
     elif cmdl_args.sigma == 'decrease':
         sigma = numpy.linspace(1, 2, number_traces)
 
-    #Execute curve fitting, returns optimal parameters array and covariance matrix
-    #Uses a Levenberg-Marquardt algorithm, i.e. damped least-squares, if no
-    #bounds are provide; otherwise a Trust Region Reflective algorithm.
-    #Please note: Both are not true least squares.
-    #They are greedy methoda and simply run into the nearest local minimum.
+    #Select the model per metric, either the given one or the one that
+    #predicts left-out runs best, see select_projection_models
+    y = numpy.stack([y_para, y_load, y_comm, y_comp, y_glob])
+    if cmdl_args.model == 'auto' and number_traces < 3:
+        if report:
+            print('==Warning== The automatic model selection requires at least 3 traces. Using amdahl.')
+        models = ['amdahl'] * len(y)
+    elif cmdl_args.model == 'auto':
+        models, scores = select_projection_models(x_proc, y, sigma, bounds)
+        if report:
+            print_model_scores(models, scores)
+    else:
+        models = [cmdl_args.model] * len(y)
+
+    #Fit all metrics of each model at once, returns optimal parameters in the
+    #order of the rows of y, see fit_projection.
+    #Please note: This is not a global optimization; like curve_fit, the
+    #iteration runs into the nearest local minimum of a coarse scan of f.
     #However, this should work fine for this simple 1D optimization.
-    #Use try to check for SciPy version.
-    try:
-        para_opt, para_cov = scipy.optimize.curve_fit(model, x_proc, y_para, sigma=sigma, bounds=bounds)
-        load_opt, load_cov = scipy.optimize.curve_fit(model, x_proc, y_load, sigma=sigma, bounds=bounds)
-        comm_opt, comm_cov = scipy.optimize.curve_fit(model, x_proc, y_comm, sigma=sigma, bounds=bounds)
-        comp_opt, comp_cov = scipy.optimize.curve_fit(model, x_proc, y_comp, sigma=sigma, bounds=bounds)
-        glob_opt, glob_cov = scipy.optimize.curve_fit(model, x_proc, y_glob, sigma=sigma, bounds=bounds)
-    except TypeError:
-        print('==Error== Projection failed! The script requires SciPy 0.17.0 or newer.')
-        return
+    opt = numpy.zeros((len(y), 2))
+    for model in set(models):
+        rows = [row for row in range(len(y)) if models[row] == model]
+        opt[rows] = fit_projection(model, x_proc, y[rows], sigma, bounds)[0]
+
+    return x_proc, y, sigma, bounds, models, opt
+
+
+def compute_projection(mod_factors, trace_list, trace_processes, cmdl_args, runtime=None, scaling='strong'):
+    """Computes the projection from the gathered model factors, writes it to
+    the gnuplot file and the projection table, and returns the according
+    dictionary of fitted prediction functions, see get_projection_callables.
+    The runtime of the smallest trace in seconds and the scaling type are used
+    to project the runtime and core hours, see project_resources, and to
+    recommend a number of processes for --efficiency-floor and --budget."""
+
+    if cmdl_args.debug:
+        print('==DEBUG== Computing projection of model factors.')
+
+    number_traces = len(trace_list)
+
+    #Set limit for projection
+    if cmdl_args.limit:
+        limit = cmdl_args.limit
+    else:
+        limit = '10000'
+
+    x_proc, y, sigma, bounds, models, opt = fit_mod_factors(mod_factors, trace_list, trace_processes, cmdl_args)
+    y_para, y_load, y_comm, y_comp, y_glob = y
+    load_opt, comm_opt, comp_opt = opt[1:4]
+    load_model, comm_model, comp_model = models[1:4]
+
+    #Evaluate the projection on a log-spaced grid up to the limit
+    x_grid = numpy.geomspace(x_proc[0], max(float(limit), x_proc[0]), projection_grid_points)
+    values = evaluate_projection(models, opt, x_grid)
+
+    #Compute the confidence bands by bootstrapping the fitted metrics, i.e.
+    #load, comm, and comp; para and glob are their products as in gnuplot
+    bands = None
+    if cmdl_args.confidence and number_traces < 3:
+        print('==Warning== The confidence bands require at least 3 traces. Skipping them.')
+    elif cmdl_args.confidence:
+        curves = numpy.zeros((cmdl_args.resamples, 3, len(x_grid)))
+        #One independent seed per metric; a group of metrics with the same
+        #model uses the seed of its first metric
+        seeds = numpy.random.SeedSequence(0).spawn(3)
+        for model in set(models[1:4]):
+            rows = [row for row in range(1, 4) if models[row] == model]
+            curves[:, numpy.array(rows) - 1] = compute_bootstrap_curves(model, x_proc, y[rows], sigma, bounds, opt[rows], x_grid, seeds[rows[0] - 1], cmdl_args)
+        para_curves = curves[:, 0] * curves[:, 1] / 100
+        curves = numpy.stack([para_curves, curves[:, 0], curves[:, 1], curves[:, 2], para_curves * curves[:, 2] / 100], axis=1)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            bands = tuple(numpy.nanpercentile(curves, [50 * (1 - cmdl_args.confidence), 50 * (1 + cmdl_args.confidence)], axis=0))
+
+    #Combine the projected global efficiency into runtime and core hours
+    resources = project_resources(models, opt, x_grid, x_proc[0], runtime, scaling)[1:]
+
+    write_projection_grid(x_grid, values, models, opt, bands, resources)
 
     #Create the fitting functions for gnuplot; 2 degrees of freedom: x0, f
-    if model == amdahl:
-        #Select whether para and glob are fitted or multiplied according to model
-        #para_fit = ' '.join(['para( x ) = ( x >',str(x_proc[0]),') ?',str(para_opt[0]),'/ (',str(para_opt[1]),'+ ( 1 -',str(para_opt[1]),') * x ) : 1/0'])
-        para_fit = ' '.join(['para( x ) = load( x ) * comm( x ) / 100'])
-        load_fit = ' '.join(['load( x ) = ( x >',str(x_proc[0]),') ?',str(load_opt[0]),'/ (',str(load_opt[1]),'+ ( 1 -',str(load_opt[1]),') * x ) : 1/0'])
-        comm_fit = ' '.join(['comm( x ) = ( x >',str(x_proc[0]),') ?',str(comm_opt[0]),'/ (',str(comm_opt[1]),'+ ( 1 -',str(comm_opt[1]),') * x ) : 1/0'])
-        comp_fit = ' '.join(['comp( x ) = ( x >',str(x_proc[0]),') ?',str(comp_opt[0]),'/ (',str(comp_opt[1]),'+ ( 1 -',str(comp_opt[1]),') * x ) : 1/0'])
-        #glob_fit = ' '.join(['glob( x ) = ( x >',str(x_proc[0]),') ?',str(glob_opt[0]),'/ (',str(glob_opt[1]),'+ ( 1 -',str(glob_opt[1]),') * x ) : 1/0'])
-        glob_fit = ' '.join(['glob( x ) = para( x ) * comp( x ) / 100'])
-
-    elif model == pipe:
-        #Select whether para and glob are fitted or multiplied according to model
-        #para_fit = ' '.join(['para( x ) = ( x >',str(x_proc[0]),') ?',str(para_opt[0]),'* x / ( ( 1 -',str(para_opt[1]),') +',str(para_opt[1]),'* ( 2 * x - 1 ) ) : 1/0'])
-        para_fit = ' '.join(['para( x ) = load( x ) * comm( x ) / 100'])
-        load_fit = ' '.join(['load( x ) = ( x >',str(x_proc[0]),') ?',str(load_opt[0]),'* x / ( ( 1 -',str(load_opt[1]),') +',str(load_opt[1]),'* ( 2 * x - 1 ) ) : 1/0'])
-        comm_fit = ' '.join(['comm( x ) = ( x >',str(x_proc[0]),') ?',str(comm_opt[0]),'* x / ( ( 1 -',str(comm_opt[1]),') +',str(comm_opt[1]),'* ( 2 * x - 1 ) ) : 1/0'])
-        comp_fit = ' '.join(['comp( x ) = ( x >',str(x_proc[0]),') ?',str(comp_opt[0]),'* x / ( ( 1 -',str(comp_opt[1]),') +',str(comp_opt[1]),'* ( 2 * x - 1 ) ) : 1/0'])
-        #glob_fit = ' '.join(['glob( x ) = ( x >',str(x_proc[0]),') ?',str(glob_opt[0]),'* x / ( ( 1 -',str(glob_opt[1]),') +',str(glob_opt[1]),'* ( 2 * x - 1 ) ) : 1/0'])
-        glob_fit = ' '.join(['glob( x ) = para( x ) * comp( x ) / 100'])
-
-    elif model == linear:
-        #Select whether para and glob are fitted or multiplied according to model
-        #para_fit = ' '.join(['para( x ) = ( x >',str(x_proc[0]),') ?',str(para_opt[0]),'+ x *',str(para_opt[1]),': 1/0'])
-        para_fit = ' '.join(['para( x ) = load( x ) * comm( x ) / 100'])
-        load_fit = ' '.join(['load( x ) = ( x >',str(x_proc[0]),') ?',str(load_opt[0]),'+ x *',str(load_opt[1]),': 1/0'])
-        comm_fit = ' '.join(['comm( x ) = ( x >',str(x_proc[0]),') ?',str(comm_opt[0]),'+ x *',str(comm_opt[1]),': 1/0'])
-        comp_fit = ' '.join(['comp( x ) = ( x >',str(x_proc[0]),') ?',str(comp_opt[0]),'+ x *',str(comp_opt[1]),': 1/0'])
-        #glob_fit = ' '.join(['glob( x ) = ( x >',str(x_proc[0]),') ?',str(glob_opt[0]),'+ x *',str(glob_opt[1]),': 1/0'])
-        glob_fit = ' '.join(['glob( x ) = para( x ) * comp( x ) / 100'])
+    #para and glob are multiplied from the fitted metrics instead of fitted,
+    #e.g. get_projection_function('para', models[0], opt[0], x_proc[0])
+    para_fit = ' '.join(['para( x ) = load( x ) * comm( x ) / 100'])
+    load_fit = get_projection_function('load', load_model, load_opt, x_proc[0])
+    comm_fit = get_projection_function('comm', comm_model, comm_opt, x_proc[0])
+    comp_fit = get_projection_function('comp', comp_model, comp_opt, x_proc[0])
+    glob_fit = ' '.join(['glob( x ) = para( x ) * comp( x ) / 100'])
 
     #Create Gnuplot file
     gp_template = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'cfgs', 'modelfactors.gp')
@@ -914,6 +3582,20 @@ def compute_projection(mod_factors, trace_list, trace_processes, cmdl_args):
     content = [line.replace('#REPLACE_BY_COMP_FUNCTION', comp_fit ) for line in content]
     content = [line.replace('#REPLACE_BY_GLOB_FUNCTION', glob_fit ) for line in content]
 
+    #Replace confidence bands, which are plotted below the projection functions
+    band_blocks = ''
+    band_plots = ''
+    if bands:
+        lower, upper = bands
+        for index, name in enumerate(['para', 'load', 'comm', 'comp', 'glob']):
+            band_blocks += '$' + name + '_band << EOD\n'
+            for point in range(len(x_grid)):
+                band_blocks += ' '.join([str(x_grid[point]), str(lower[index, point]), str(upper[index, point])]) + '\n'
+            band_blocks += 'EOD\n'
+            band_plots += '$' + name + '_band using 1:2:3 with filledcurves fs transparent solid 0.2 noborder ls ' + str(index + 1) + ' notitle,\\\n     '
+    content = [line.replace('#REPLACE_BY_CONFIDENCE_BANDS\n', band_blocks) for line in content]
+    content = [line.replace('plot para(x)', 'plot ' + band_plots + 'para(x)') for line in content]
+
     file_path = os.path.join(os.getcwd(), 'modelfactors.gp')
     with open(file_path, 'w') as f:
         f.writelines(content)
@@ -950,7 +3632,136 @@ def compute_projection(mod_factors, trace_list, trace_processes, cmdl_args):
 
     print('Projection written to ' + file_path)
 
-    return
+    #Recommend a number of processes for the efficiency floor and the budget
+    if cmdl_args.budget is not None and runtime is None:
+        print('==Warning== --budget requires the runtime of the smallest trace, which is not in the raw data. Skipping the recommendation.')
+    elif cmdl_args.efficiency_floor is not None or cmdl_args.budget is not None:
+        print('')
+        print_recommendation(get_recommendation(models, opt, x_proc[0], float(limit), runtime, scaling, cmdl_args), cmdl_args)
+
+    return get_projection_callables(models, opt)
+
+
+def project_mod_factors_csv(task):
+    """Reads the model factors of one csv file and fits the projection, see
+    fit_mod_factors. Processes one task of project_mod_factors_csvs, which are
+    the csv file, the numbers of processes to evaluate the projection at, and
+    the command line arguments.
+    Returns the csv file, the number of traces, the list of models, the
+    parameters, the projected metrics, the scaling type, the projected
+    speedup, runtime, and core hours, see project_resources, and the
+    recommended number of processes or None, see get_recommendation. The
+    projected values are NaN below the smallest run. If any step fails, e.g.
+    for a malformed file, only the csv file and the error message are
+    returned, so the other files of the batch are still projected.
+    """
+    file_path, x_grid, cmdl_args = task
+    import_numpy()
+
+    try:
+        return project_mod_factors_file(file_path, x_grid, cmdl_args)
+    except SystemExit:
+        #The readers print their error and exit, which would kill the worker
+        return file_path, 'could not project model factors, see the error above'
+    except Exception as error:
+        return file_path, 'could not project model factors: ' + type(error).__name__ + ': ' + str(error)
+
+
+def project_mod_factors_file(file_path, x_grid, cmdl_args):
+    """Reads and projects the model factors of one csv file for
+    project_mod_factors_csv, which describes the returned tuple."""
+    mod_factors, trace_list, trace_processes = read_mod_factors_csv(file_path, cmdl_args)
+    raw_data = read_raw_data_csv(file_path)[0]
+
+    x_proc, _, _, _, models, opt = fit_mod_factors(mod_factors, trace_list, trace_processes, cmdl_args, report=False)
+    values = evaluate_projection(models, opt, x_grid)
+    values[:, x_grid < x_proc.min()] = numpy.nan
+
+    runtime = get_reference_runtime(raw_data, trace_list)
+    scaling = get_projection_scaling(raw_data, trace_list, trace_processes, cmdl_args)
+    resources = numpy.stack(project_resources(models, opt, x_grid, x_proc[0], runtime, scaling)[1:])
+    resources[:, x_grid < x_proc.min()] = numpy.nan
+
+    recommendation = None
+    if cmdl_args.budget is not None and runtime is None:
+        print('==Warning== --budget requires the runtime of the smallest trace, which is not in the raw data of ' + file_path + '.')
+    elif cmdl_args.efficiency_floor is not None or cmdl_args.budget is not None:
+        recommendation = get_recommendation(models, opt, x_proc[0], x_grid[-1], runtime, scaling, cmdl_args)
+    if recommendation is not None:
+        recommendation = recommendation[0]
+
+    return file_path, len(trace_list), models, opt, values, scaling, resources, recommendation
+
+
+def project_mod_factors_csvs(csv_list, cmdl_args):
+    """Projects the model factors of all csv files in csv_list, computed by a
+    pool of --jobs processes, and writes the models, parameters, and projected
+    metrics of each file to modelfactors.projections.csv in the execution
+    directory, followed by the projected speedup, runtime, and core hours with
+    the scaling type as model. The projection is evaluated at the powers of two
+    up to the limit and the limit itself, so the rows of all files share the
+    same columns. The last column holds the recommended number of processes
+    for --efficiency-floor and --budget, or NaN.
+    """
+    if cmdl_args.confidence is not None:
+        print('==Warning== --confidence is only supported for a single modelfactors.csv. Skipping confidence bands.')
+
+    if cmdl_args.limit:
+        limit = float(cmdl_args.limit)
+    else:
+        limit = 10000.0
+    x_grid = 2 ** numpy.arange(int(numpy.log2(limit)) + 1, dtype=float)
+    if x_grid[-1] < limit:
+        x_grid = numpy.append(x_grid, limit)
+
+    metrics = [mod_factors_doc[metric].strip() for metric in projection_metrics]
+    tasks = [(file_path, x_grid, cmdl_args) for file_path in csv_list]
+    failed = 0
+
+    #Write to a temporary file, so an interrupted batch leaves no partial table
+    file_path = os.path.join(os.getcwd(), 'modelfactors.projections.csv')
+    temporary = file_path + '.' + str(os.getpid()) + '.tmp'
+    try:
+        with open(temporary, 'w') as output:
+            line = 'File;Traces;Metric;Model;x0;f'
+            for x in x_grid:
+                line += ';' + '{0:.0f}'.format(x)
+            line += ';Recommended processes'
+            output.write(line + '\n')
+
+            for result in map_prv_tasks(project_mod_factors_csv, tasks, cmdl_args.jobs):
+                if len(result) == 2:
+                    print('==ERROR==', result[0] + ':', result[1])
+                    failed += 1
+                    continue
+
+                csv_file, number_traces, models, opt, values, scaling, resources, recommendation = result
+                if recommendation is None:
+                    recommendation = 'NaN'
+
+                #The resources are not fitted, so they have no parameters
+                rows = [(metric, models[index], opt[index], values[index]) for index, metric in enumerate(metrics)]
+                rows += [(name, scaling, (numpy.nan, numpy.nan), resources[index])
+                         for index, name in enumerate(['Speedup', 'Runtime (s)', 'Core hours'])]
+
+                for metric, model, params, row in rows:
+                    line = ';'.join([csv_file, str(number_traces), metric, model])
+                    for value in list(params) + list(row):
+                        if numpy.isnan(value):
+                            line += ';NaN'
+                        else:
+                            line += ';' + '{0:.6f}'.format(value)
+                    line += ';' + str(recommendation)
+                    output.write(line + '\n')
+    except:
+        save_remove(temporary)
+        raise
+    os.replace(temporary, file_path)
+
+    print('Projected', len(csv_list) - failed, 'of', len(csv_list), 'csv files.')
+    print('Projection table written to ' + file_path)
+    if failed:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -965,30 +3776,59 @@ if __name__ == "__main__":
     #Check if paramedir and Dimemas are in the path
     check_installation(cmdl_args)
 
+    #Set up the admission control for the external tools
+    if cmdl_args.memory_budget:
+        memory_budget = MemoryBudget(cmdl_args.memory_budget)
+
     #Check if projection-only mode is selected
     #If not: compute everything
     #Else: read the passed modelfactors.csv
     if not cmdl_args.project:
         trace_list, trace_processes = get_traces_from_args(cmdl_args)
 
+        #Read the raw data of the series to extend first, so an invalid file
+        #is reported before any trace is analyzed
+        if cmdl_args.append:
+            stored = read_raw_data_csv(cmdl_args.append)
+            if stored[0] is None:
+                print('==ERROR==', cmdl_args.append, 'does not contain the raw data of the traces.')
+                sys.exit(1)
+
         #Analyze the traces and gather the raw input data
         raw_data = gather_raw_data(trace_list, trace_processes, cmdl_args)
+
+        #Add the stored raw data to compute the model factors of the whole series
+        if cmdl_args.append:
+            raw_data, trace_list, trace_processes = merge_raw_data(stored, raw_data, trace_list, trace_processes)
         print_raw_data_table(raw_data, trace_list, trace_processes)
 
         #Compute the model factors and print them
-        mod_factors = compute_model_factors(raw_data, trace_list, trace_processes, cmdl_args)
+        scaling = get_scaling_type(raw_data, trace_list, trace_processes, cmdl_args)
+        mod_factors = compute_model_factors(raw_data, trace_list, trace_processes, cmdl_args, scaling)
         print_mod_factors_table(mod_factors, trace_list, trace_processes)
         print_mod_factors_csv(mod_factors, trace_list, trace_processes)
+
+        #The csv file holds all raw data now
+        remove_checkpoint()
     else:
-        #Read the model factors from the csv file
-        mod_factors, trace_list, trace_processes = read_mod_factors_csv(cmdl_args)
+        #Project many csv files at once if several files, a directory, or a
+        #pattern are given, else read the model factors from the csv file
+        csv_list = get_projection_csvs(cmdl_args)
+        if len(cmdl_args.project) == 1 and csv_list == cmdl_args.project:
+            mod_factors, trace_list, trace_processes = read_mod_factors_csv(csv_list[0], cmdl_args)
+            raw_data = read_raw_data_csv(csv_list[0])[0]
+            scaling = get_projection_scaling(raw_data, trace_list, trace_processes, cmdl_args)
+        elif not import_numpy():
+            print('NumPy module not available. Skipping projection.')
+            sys.exit(1)
+        else:
+            project_mod_factors_csvs(csv_list, cmdl_args)
+            sys.exit(0)
 
-    #Compute projection if SciPy and NumPy are installed.
-    try:
-        numpy.__version__
-        scipy.__version__
-    except NameError:
-        print('Scipy or NumPy module not available. Skipping projection.')
+    #Compute projection if NumPy is installed.
+    if not import_numpy():
+        print('NumPy module not available. Skipping projection.')
         sys.exit(1)
 
-    compute_projection(mod_factors, trace_list, trace_processes, cmdl_args)
+    compute_projection(mod_factors, trace_list, trace_processes, cmdl_args,
+                       get_reference_runtime(raw_data, trace_list), scaling)